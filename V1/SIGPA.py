@@ -1,7 +1,7 @@
 import zipfile
 import pandas as pd
 from datetime import datetime, timedelta
-from data_pass_by_pass import pbp_data,save_dataframe
+from data_pass_by_pass import pbp_data,save_dataframe,parse_dates
 
 def data_accepted(zip_filename,start_date, end_date):
 
@@ -48,7 +48,7 @@ def data_global(zip_filename,start: str):
     start_date = datetime.strptime(start, "%Y-%m-%d").date()
     
     # convert 'Date_Naiss' column to datetime.date
-    data['DATE'] = pd.to_datetime(data['DATE'], dayfirst=True).dt.date
+    data['DATE'] = parse_dates(data['DATE'], '%Y-%m-%d').dt.date
 
     # filter rows in the DataFrame based on start and end dates
     filtered_data = data[(data['DATE'] >= start_date)]
@@ -70,13 +70,11 @@ def data_for_sigpa(zip_filename,start_date, end_date,aliment,Farming):
     data.reset_index(drop=True, inplace=True)
     # clear ligns with nan in animal columns
     data = data.dropna(subset=['ANIMAL'])
-    # put columns HEURE and DATE to the same format by replacing 24H by 00H and transforme it to datetime
-    data['HEURE'] = data['HEURE'].replace('24:00:00', '00:00:00')
-    data_accept['HEURE'] = data_accept['HEURE'].replace('24:00:00', '00:00:00')
-    data['DATE'] = pd.to_datetime(data['DATE'])
-    data_accept['DATE'] = pd.to_datetime(data_accept['DATE'])
-    data['HEURE'] = pd.to_datetime(data['HEURE'], format='%H:%M:%S').dt.time
-    data_accept['HEURE'] = pd.to_datetime(data_accept['HEURE'], format='%H:%M:%S').dt.time
+    # put columns HEURE and DATE to the same format (24:00:00 is read as 00:00:00)
+    data['DATE'] = parse_dates(data['DATE'])
+    data_accept['DATE'] = parse_dates(data_accept['DATE'], '%Y-%m-%d')
+    data['HEURE'] = parse_dates(data['HEURE'], '%H:%M:%S').dt.time
+    data_accept['HEURE'] = parse_dates(data_accept['HEURE'], '%H:%M:%S').dt.time
     # put the Offert and QUANTITE on the ligns where it's the same date in the two files
     data = pd.merge(data, data_accept[['URBAN_ID', 'DATE', 'HEURE', 'TYPE', 'QUANTITE']], 
                        on=['URBAN_ID', 'DATE', 'HEURE'], how='left')
@@ -1,5 +1,5 @@
 import pandas as pd
-from data_pass_by_pass import pbp_data,save_dataframe
+from data_pass_by_pass import pbp_data,save_dataframe,parse_dates
 from SIGPA import data_global
 
 
@@ -44,10 +44,10 @@ def data_dbd(df, conso_lait, visites,list):
     grouped = grouped.rename(columns={'Age': 'JOUR'})
     # get the number of denied passage besause of no right
     total = data_global(zip_filename,start_date)
-    total['DATE'] = pd.to_datetime(total['DATE'])
+    total['DATE'] = parse_dates(total['DATE'])
     total = total.groupby(['URBAN_ID', 'DATE']).size().reset_index(name='Nb_Reffus')
     grouped = grouped.rename(columns={'Date_debut': 'DATE'})
-    grouped['DATE'] = pd.to_datetime(grouped['DATE'])
+    grouped['DATE'] = parse_dates(grouped['DATE'], '%Y-%m-%d')
     grouped = pd.merge(grouped, total, on=['DATE', 'URBAN_ID'], how='left')
     grouped['Nb_Reffus']=grouped['Nb_Reffus']-grouped['Nombre_de_visites']
     print(grouped)
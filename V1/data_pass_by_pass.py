@@ -3,32 +3,70 @@ import pandas as pd
 import zipfile
 from datetime import datetime
 
-def calculate_time_diff(cows_data , i):
+def parse_date_strings(strings, date_format):
     """
-    calculate the amount of time the cows drank.
+    convert date strings to datetime with their known format.
+    the DAL writes the midnight ending a day as 24:00:00, it is read as 00:00:00 of the next day.
     args:
-    - cows_data: data cleaned up to calculated the amount of time they drank.
-    - i: row in the data set
+    - strings: column of date strings.
+    - date_format: format of the strings ('%d/%m/%Y', '%Y-%m-%d', '%H:%M:%S', ...).
+    returns:
+    - column of datetime, NaT for missing values
+    """
+    parsed = pd.to_datetime(strings, format=date_format, errors='coerce')
+
+    # only the strings that could not be parsed are checked for 24:00:00, other errors are raised
+    failed = parsed.isna() & strings.notna()
+    if failed.any():
+        fixed = strings[failed].astype(str)
+        midnight = fixed.str.contains('24:00:00', regex=False)
+        retry = pd.to_datetime(fixed.str.replace('24:00:00', '00:00:00', regex=False), format=date_format)
+        parsed[failed] = retry + pd.to_timedelta(midnight.astype(int), unit='D')
+    return parsed
+
+def parse_dates(values, date_format=None):
+    """
+    convert dates to datetime with their known format, each distinct value only once (the dates repeat a lot).
+    it is the same function as parse_dates in V2/utils.py.
+    args:
+    - values: column of date strings, or of datetime.date.
+    - date_format: format of the strings (see parse_date_strings), None for datetime.date values.
     returns:
-    - time in 00:00:00 format
+    - column of datetime with the index of values, NaT for missing values
     """
-    #get the date/hours data of cows_data
-    DStart = cows_data.loc[i,"Date_debut"]
-    HStart = cows_data.loc[i,"Heure_debut"]
-    DEnd = cows_data.loc[i,"Date_fin"]
-    HEnd = cows_data.loc[i,"Heure_fin"]
+    # timestamps with microseconds are nearly all different, caching them would only cost time
+    sample = values.iloc[:1000]
+    if date_format is not None and sample.nunique() * 2 > len(sample):
+        return parse_date_strings(values, date_format)
 
+    # the dates repeat a lot, only the distinct values are parsed
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques)
+    parsed = pd.to_datetime(uniques) if date_format is None else parse_date_strings(uniques, date_format)
+
+    # put the parsed dates back on every lign
+    return pd.Series(parsed.array.take(codes, allow_fill=True), index=values.index, name=values.name)
+
+def calculate_time_diff(cows_data):
+    """
+    calculate the amount of time the cows drank, for all the passages.
+    args:
+    - cows_data: data cleaned up to calculated the amount of time they drank.
+    returns:
+    - column of time in 00:00:00 format
+    """
     # combine the date and time into datetime
-    start_datetime = datetime.strptime(DStart + " " + HStart, "%Y-%m-%d %H:%M:%S")
-    end_datetime = datetime.strptime(DEnd + " " + HEnd, "%Y-%m-%d %H:%M:%S")
-    
-    time_difference = end_datetime - start_datetime
-    
+    start_datetime = parse_dates(cows_data["Date_debut"] + " " + cows_data["Heure_debut"], "%Y-%m-%d %H:%M:%S")
+    end_datetime = parse_dates(cows_data["Date_fin"] + " " + cows_data["Heure_fin"], "%Y-%m-%d %H:%M:%S")
+
+    seconds = (end_datetime - start_datetime).dt.total_seconds().astype(int)
+
     # format the time difference
-    hours, remainder = divmod(time_difference.total_seconds(), 3600)
-    minutes, seconds = divmod(remainder, 60)
-    
-    return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+    hours = (seconds // 3600).astype(str).str.zfill(2)
+    minutes = (seconds % 3600 // 60).astype(str).str.zfill(2)
+    seconds = (seconds % 60).astype(str).str.zfill(2)
+
+    return hours + ":" + minutes + ":" + seconds
 
 def generate_bande(date_str):
     """
@@ -83,7 +121,7 @@ def animal_caract(zip_filename,start: str, end: str):
     end_date = datetime.strptime(end, "%Y-%m-%d").date()
     
     # convert 'Date_Naiss' column to datetime.date
-    cows_id['Date_Naiss'] = pd.to_datetime(cows_id['Date_Naiss'], dayfirst=True).dt.date
+    cows_id['Date_Naiss'] = parse_dates(cows_id['Date_Naiss'], '%d/%m/%Y').dt.date
 
     # filter rows in the DataFrame based on start and end dates
     filtered_cows_id = cows_id[(cows_id['Date_Naiss'] >= start_date) & (cows_id['Date_Naiss'] <= end_date)]
@@ -169,33 +207,14 @@ def pbp_data(zip_filename,start_date, end_date):# data for sigpa and other
     final_df = final_df.dropna(subset=['NUM'])
     # reset the index of the ligns
     final_df.reset_index(drop=True, inplace=True)
-    # create the list of value to add them in cows_data
-    age = []
-    semaine = []
-    sem = []
-    time_diff = []
-
-    for i in range(len(final_df)):
-        # transform date into number of days 
-        date_str1 = str(final_df.loc[i, "Date_Naiss"])
-        date_str2 = final_df.loc[i, "Date_debut"]
-        date1 = datetime.strptime(date_str1, '%Y-%m-%d')
-        date2 = datetime.strptime(date_str2, '%Y-%m-%d')
-        difference = date2 - date1
-        nombre_de_jours = difference.days
-
-        # list about the number of days/weeks since the cows were born
-        age = age + [nombre_de_jours]
-        semaine = semaine + [round(age[i]/7,1)]
-        sem = sem + ["s"+str(int(semaine[i]+1))]
-        # time the cows drank milk
-        time_diff = time_diff + [calculate_time_diff(final_df , i)]
-
-    # replace columns by the value
+    # transform dates into number of days since the cows were born
+    age = (parse_dates(final_df["Date_debut"], '%Y-%m-%d') - parse_dates(final_df["Date_Naiss"])).dt.days
+
+    # replace columns by the number of days/weeks since the cows were born and the time the cows drank milk
     final_df.loc[:, 'Age'] = age
-    final_df.loc[:, 'Semaine'] = semaine
-    final_df.loc[:, 'Sem'] = sem
-    final_df.loc[:, 'Temps_buvee'] = time_diff
+    final_df.loc[:, 'Semaine'] = (age / 7).round(1)
+    final_df.loc[:, 'Sem'] = "s" + (final_df['Semaine'] + 1).astype(int).astype(str)
+    final_df.loc[:, 'Temps_buvee'] = calculate_time_diff(final_df)
 
     # transforme NUM float into NUM int
     final_df['NUM'] = final_df['NUM'].astype(int)
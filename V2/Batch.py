@@ -0,0 +1,225 @@
+import os
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from Cache import ExportCache
+from Incremental import par_passage_incremental
+from Pipeline import OUTPUTS, Pipeline
+from Report import RunReport, save_measured
+from Stream import STREAM_CHUNKSIZE, needs_streaming, stream_export
+from utils import DalExport, station_name
+
+# Errors of an export that cannot be processed: missing, corrupt or truncated ZIP, or unexpected content
+EXPORT_ERRORS = (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile, zlib.error)
+
+def curves_from_config(config):
+    """
+    Get the curves and their theoretical values from the configuration.
+    Args:
+    - config: Dictionary of the configuration, with a 'curves' list of
+      {'courbe', 'aliment', 'conso_lait', 'visites'} entries.
+    Returns:
+    - (courbe, aliment, conso_lait, visites) lists as used by par_passage and par_jour.
+    """
+    curves = config.get('curves', [])
+    if not curves:
+        raise ValueError("The configuration has no curve")
+    courbe = [curve['courbe'] for curve in curves]
+    aliment = [curve.get('aliment', '') for curve in curves]
+    conso_lait = [[float(value) for value in curve['conso_lait']] for curve in curves]
+    visites = [[float(value) for value in curve['visites']] for curve in curves]
+    return courbe, aliment, conso_lait, visites
+
+def process_export(zip_filename, config, output_dir, outputs):
+    """
+    Run the V2 pipeline on one export and write the selected outputs, with the report
+    of the run (see Report.RunReport) in the same folder.
+    Args:
+    - zip_filename: Path to the zip file.
+    - config: Dictionary of the configuration (dates, curves, IPG number, weeks, engine, stream, chunksize, profile,
+      incremental, state_dir, cache_dir).
+    - output_dir: Folder where the CSV files are written.
+    - outputs: List of output names (keys of OUTPUTS).
+    Returns:
+    - List of the written file paths.
+    Raises:
+    - ValueError: When some outputs could not be computed, once the other outputs are written.
+    """
+    courbe, aliment, conso_lait, visites = curves_from_config(config)
+    os.makedirs(output_dir, exist_ok=True)
+    settings = (courbe, aliment, conso_lait, visites, config['start_date'], config['end_date'], config.get('ipg', ''),
+                config.get('weeks', len(conso_lait[0])), config.get('interpolation', False), config.get('engine', 'pandas'))
+
+    # The parsed members are only cached in the folder given by the configuration or by DAL_CACHE_DIR
+    cache = ExportCache(config['cache_dir']) if config.get('cache_dir') else None
+
+    failed = []
+    with RunReport(zip_filename, config.get('profile', False)) as report, DalExport(zip_filename, cache=cache) as export:
+        # Exports too large for the memory are read block by block, unless only their new rows are read
+        if not config.get('incremental') and (config.get('stream') or needs_streaming(export)):
+            files = {name: os.path.join(output_dir, OUTPUTS[name][1]) for name in outputs}
+            written = stream_export(export, files, *settings, chunksize=config.get('chunksize', STREAM_CHUNKSIZE),
+                                    report=report)
+        else:
+            # Only the selected outputs and the steps they need are computed. Each output is
+            # saved as soon as it is computed, an output that fails does not stop the others
+            pipeline = Pipeline(export, *settings)
+            if config.get('incremental'):
+                # Only the rows newer than the previous export of the station are read
+                with report.stage('incremental') as record:
+                    passages, daily = par_passage_incremental(
+                        export, courbe, aliment, courbe, conso_lait, visites, config['start_date'], config['end_date'],
+                        config.get('interpolation', False), directory=config.get('state_dir'),
+                        engine=config.get('engine', 'pandas'))
+                    record['rows_out'] = len(passages)
+                pipeline.set('passages', passages)
+                pipeline.set('daily', daily)
+            written = []
+            for name in outputs:
+                try:
+                    data = pipeline.run([name], report=report)[name]
+                except (ValueError, KeyError) as e:
+                    failed.append(f"{name}: {str(e)}")
+                    continue
+                written += save_measured([(data, os.path.join(output_dir, OUTPUTS[name][1]))], report)
+
+    report.save(output_dir)
+    if failed:
+        raise ValueError(f"Outputs not written ({'; '.join(failed)})")
+    return [path for path in written if path is not None]
+
+def find_exports(paths):
+    """
+    List the ZIP exports given directly or found in directories.
+    Args:
+    - paths: List of ZIP files and folders.
+    Returns:
+    - List of ZIP file paths, sorted by name within each folder.
+    """
+    exports = []
+    for path in paths:
+        if os.path.isdir(path):
+            exports.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if name.lower().endswith('.zip'))
+        else:
+            exports.append(path)
+    return exports
+
+def station_folders(zip_filenames):
+    """
+    Name the output folder of each export after its station.
+    Args:
+    - zip_filenames: List of ZIP file paths.
+    Returns:
+    - List of distinct folder names, in the order of zip_filenames. The file name is used when
+      a station has several exports, then the parent folder and the file name when exports of
+      different folders have the same name, and a counter is added to the same path given twice.
+    """
+    names = [station_name(zip_filename) for zip_filename in zip_filenames]
+
+    # Each name shared by several exports is replaced by a more precise one
+    file_name = lambda zip_filename: os.path.splitext(os.path.basename(zip_filename))[0]
+    parent_name = lambda zip_filename: os.path.basename(os.path.dirname(os.path.abspath(zip_filename)))
+    for precise in (file_name, lambda zip_filename: f"{parent_name(zip_filename)}_{file_name(zip_filename)}"):
+        names = [precise(zip_filename) if names.count(name) > 1 else name
+                 for name, zip_filename in zip(names, zip_filenames)]
+
+    folders = []
+    for name in names:
+        folder, count = name, 1
+        while folder in folders:
+            count += 1
+            folder = f"{name}_{count}"
+        folders.append(folder)
+    return folders
+
+def process_station(zip_filename, config, output_dir, outputs):
+    """
+    Process one export in a worker process, errors are returned instead of raised so that
+    one bad export does not stop the other stations.
+    Returns:
+    - (written paths, None) or (None, error message).
+    """
+    try:
+        return process_export(zip_filename, config, output_dir, outputs), None
+    except EXPORT_ERRORS as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {str(e)}"
+
+def combine_outputs(folders, output_dir, outputs):
+    """
+    Concatenate the outputs of the stations in herd-wide files, with a first
+    'Station' column. The CSV lines are copied as they are.
+    Args:
+    - folders: List of (station, output folder) pairs, in the order of the lines.
+    - output_dir: Folder of the herd-wide files.
+    - outputs: List of output names (keys of OUTPUTS).
+    Returns:
+    - List of the written file paths.
+    """
+    written = []
+    for name in outputs:
+        filename = OUTPUTS[name][1]
+        path = os.path.join(output_dir, filename)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        header = None
+        with open(temporary, 'w', encoding='utf-8', newline='') as combined:
+            for station, folder in folders:
+                try:
+                    with open(os.path.join(folder, filename), 'r', encoding='utf-8', newline='') as file:
+                        lines = iter(file)
+                        first = next(lines, None)
+                        if first is None:
+                            continue
+                        # The header is written once, the stations share the same columns
+                        if header is None:
+                            header = first
+                            combined.write('Station;' + header)
+                        for line in lines:
+                            combined.write(f'{station};{line}')
+                except OSError:
+                    continue
+        os.replace(temporary, path)
+        print(f"DataFrame saved successfully to {path}")
+        written.append(path)
+    return written
+
+def run_batch(zip_filenames, config, output_dir, outputs, jobs=None, combined=False):
+    """
+    Process several exports in parallel processes, each station in its own folder.
+    Args:
+    - zip_filenames: List of ZIP file paths.
+    - config: Dictionary of the configuration (dates, curves, IPG number, weeks).
+    - output_dir: Folder of the station folders.
+    - outputs: List of output names (keys of OUTPUTS).
+    - jobs: Number of processes, the number of processors by default. With 1 the
+      exports are processed one after another in the current process.
+    - combined: Also write herd-wide files concatenating the stations in output_dir.
+    Returns:
+    - Dictionary of the errors by ZIP file path, empty if every export was processed.
+    """
+    # One task per export, each with its own folder
+    tasks = [(zip_filename, station, os.path.join(output_dir, station))
+             for zip_filename, station in zip(zip_filenames, station_folders(zip_filenames))]
+
+    jobs = min(jobs or os.cpu_count() or 1, len(tasks))
+    if jobs <= 1:
+        results = [process_station(zip_filename, config, folder, outputs) for zip_filename, _, folder in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(process_station, zip_filename, config, folder, outputs)
+                       for zip_filename, _, folder in tasks]
+            results = []
+            for future in futures:
+                # A worker that dies (e.g. out of memory) fails its station only
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append((None, f"{type(e).__name__}: {str(e)}"))
+
+    errors = {zip_filename: error for (zip_filename, _, _), (_, error) in zip(tasks, results) if error is not None}
+    if combined:
+        done = [(station, folder) for (_, station, folder), (_, error) in zip(tasks, results) if error is None]
+        combine_outputs(done, output_dir, outputs)
+    return errors
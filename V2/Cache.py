@@ -0,0 +1,137 @@
+import hashlib
+import os
+import shutil
+import pandas as pd
+
+# The cache is written in Feather format, it needs pyarrow
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Change this version when the parsed tables change, old entries are then ignored
+CACHE_VERSION = 3
+
+# Default location and maximum size of the cache, they can be set with environment variables.
+# The exports are only cached by default when DAL_CACHE_DIR is set
+ENV_DIRECTORY = os.environ.get('DAL_CACHE_DIR')
+DEFAULT_DIRECTORY = ENV_DIRECTORY or os.path.join(os.path.expanduser('~'), '.dal_cache')
+DEFAULT_MAX_SIZE = int(os.environ.get('DAL_CACHE_SIZE', 2 * 1024 ** 3))
+
+class ExportCache:
+    """
+    Local cache of the parsed members of DAL exports, in uncompressed Feather files
+    that are memory mapped when they are read again.
+    Each export has its own folder named after its fingerprint. The folders used
+    least recently are removed when the cache is bigger than its maximum size.
+    Args:
+    - directory: Folder of the cache.
+    - max_size: Maximum size of the cache in bytes.
+    """
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory or DEFAULT_DIRECTORY
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else max_size
+
+    @classmethod
+    def default(cls):
+        """
+        Get the cache used when none is given.
+        Returns:
+        - ExportCache in the DAL_CACHE_DIR folder, None when the variable is not set.
+        """
+        return cls(ENV_DIRECTORY) if ENV_DIRECTORY else None
+
+    @staticmethod
+    def available():
+        """Return True if pyarrow is installed, the cache is disabled otherwise."""
+        return feather is not None
+
+    @staticmethod
+    def fingerprint(zipf, *options):
+        """
+        Compute a cheap fingerprint of an export from the central directory of the ZIP.
+        Args:
+        - zipf: The opened zipfile.ZipFile of the export.
+        - options: Reading options that change the parsed tables (e.g. the CSV engine).
+        Returns:
+        - Hexadecimal string identifying the export content.
+        """
+        digest = hashlib.sha1(f'{CACHE_VERSION};{";".join(map(str, options))}'.encode())
+        # Names, sizes and CRCs of the members are enough to detect any change
+        for info in sorted(zipf.infolist(), key=lambda info: info.filename):
+            digest.update(f'{info.filename};{info.file_size};{info.CRC}\n'.encode())
+        return digest.hexdigest()
+
+    def load(self, key, member):
+        """
+        Read a parsed member from the cache.
+        Args:
+        - key: Fingerprint of the export.
+        - member: Short name of the member.
+        Returns:
+        - DataFrame, or None if the member is not in the cache.
+        """
+        path = os.path.join(self.directory, key, f'{member}.feather')
+        try:
+            table = feather.read_table(path, memory_map=True)
+        except (OSError, ValueError):
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(os.path.join(self.directory, key))
+        except OSError:
+            pass
+        return table.to_pandas()
+
+    def store(self, key, member, data):
+        """
+        Write a parsed member in the cache, then evict old entries if needed.
+        Args:
+        - key: Fingerprint of the export.
+        - member: Short name of the member.
+        - data: DataFrame to cache.
+        Returns:
+        - None
+        """
+        folder = os.path.join(self.directory, key)
+        path = os.path.join(folder, f'{member}.feather')
+        try:
+            os.makedirs(folder, exist_ok=True)
+            # Write to a temporary file first so that a reader never sees a partial file
+            temporary = f'{path}.{os.getpid()}.tmp'
+            data.reset_index(drop=True).to_feather(temporary, compression='uncompressed')
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Cache not written for {member}: {str(e)}")
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove the entries used least recently until the cache fits its maximum size.
+        Args:
+        - keep: Fingerprint of an entry that must not be removed.
+        Returns:
+        - None
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            folder = os.path.join(self.directory, name)
+            if not os.path.isdir(folder):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+            entries.append((os.path.getmtime(folder), size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every entry of the cache."""
+        shutil.rmtree(self.directory, ignore_errors=True)
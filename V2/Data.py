@@ -1,152 +1,269 @@
-from datetime import datetime
+import numpy as np
 import pandas as pd
-from utils import calculate_time_diff, data_global, animal_caract, animal_data
+from Engine import open_engine
+from utils import visit_facts, animal_caract, animal_data, open_export, parse_dates
 
-def par_passage(zip_filename, courbe, aliment, start_date="2000-01-01", end_date="3000-01-01"):
+# Types of the passages and of the daily data: the labels (dates, times, weeks) are
+# only written by the Output functions, the codes repeated on every row are categories
+PASSAGE_TYPES = {'URBAN_ID': 'int32', 'NUM': 'int32', 'Bande': 'category', 'Courbe': 'category',
+                 'ALIMENT': 'category', 'Age': 'int16', 'Week': 'int16'}
+DAILY_TYPES = {'NUM': 'int32', 'Bande': 'category', 'ALIMENT': 'category', 'JOUR': 'int16', 'Week': 'int16'}
+
+def par_passage(zip_filename, courbe, aliment, start_date="2000-01-01", end_date="3000-01-01", engine=None):
     """
     Create the first Excel data sheet with data for each passage of cows.
     Args:
-    - zip_filename: Path to the zip file to extract data.
+    - zip_filename: Path to the zip file to extract data, or a DalExport to reuse its parsed data.
     - courbe: List of curves.
     - aliment: List of corresponding feeds.
     - start_date: Start date for the data extraction.
     - end_date: End date for the data extraction.
+    - engine: Engine of the joins and aggregations (see Engine.open_engine), pandas by default.
     Returns:
     - DataFrame containing all cow data with relevant details.
     """
+    # Open the export once, every member is parsed a single time
+    with open_export(zip_filename) as export:
+        # Create the cleaned ID data for each cow
+        cows_id = animal_caract(export, start_date, end_date)
+
+        # Create the cleaned drink data of the cows of the session only
+        cows_data = animal_data(export, cows_id['URBAN_ID'])
+
+        # Build the passages of the cows of the session
+        final_df = build_passages(cows_id, cows_data, courbe, aliment, engine)
+
+        # Get the station visits with the milk they gave
+        all = visit_facts(export, start_date, cows_id['URBAN_ID'], engine)
+
+    return final_df, all
+
+def build_passages(cows_id, cows_data, courbe, aliment, engine=None):
+    """
+    Join the drink data with the cows of the session and calculate the passage columns.
+    Args:
+    - cows_id: DataFrame of the cows of the session from animal_caract.
+    - cows_data: DataFrame of drink measurements from animal_data.
+    - courbe: List of curves.
+    - aliment: List of corresponding feeds.
+    - engine: Engine of the join (see Engine.open_engine), pandas by default.
+    Returns:
+    - DataFrame with one row per passage, sorted by cow and time, typed with PASSAGE_TYPES.
+    """
     # Define the order of columns for the final DataFrame
     column_order = [
-        "URBAN_ID", "NUM", "Bande", "Courbe", "ALIMENT", "Date_Naiss", "Age", "Semaine", "Sem",
+        "URBAN_ID", "NUM", "Bande", "Courbe", "ALIMENT", "Date_Naiss", "Age", "Week",
         "Prog_lait", "Conso_lait", "Conso_mat1", "Conso_mat2", "Conso_eau",
-        "Date_debut", "Heure_debut", "Date_fin", "Heure_fin", "Temps_buvee"
+        "debut", "fin", "Temps_buvee"
     ]
 
-    # Create the cleaned ID data for each cow
-    cows_id = animal_caract(zip_filename, start_date, end_date)
-
-    # Create the cleaned drink data for each cow
-    cows_data = animal_data(zip_filename)
-
-    # Merge drink data with cow ID data
-    final_df = cows_data.merge(cows_id[['URBAN_ID', 'Date_Naiss', 'Courbe', 'NUM', 'Bande']], on='URBAN_ID', how='left')
+    # Join drink data with cow ID data, the drinks of other cows are left out
+    columns = cows_id[['URBAN_ID', 'Date_Naiss', 'Courbe', 'NUM', 'Bande']]
+    final_df = open_engine(engine).join(cows_data, columns, 'URBAN_ID')
 
     # Remove rows where 'NUM' column has NaN values
     final_df = final_df.dropna(subset=['NUM'])
 
-    # Initialize lists to store calculated values
-    age = []
-    semaine = []
-    sem = []
-    time_diff = []
-
-    for index, row in final_df.iterrows():
-        # Calculate age in days
-        date1 = row["Date_Naiss"]
-        date2 = datetime.strptime(row["Date_debut"], '%Y-%m-%d').date()
-        difference = date2 - date1
-        nombre_de_jours = difference.days
-
-        # Append calculated values to the lists
-        age.append(nombre_de_jours)
-        semaine.append(round(age[-1] / 7, 1))
-        sem.append("s" + str(int(semaine[-1] + 1)))
-        time_diff.append(calculate_time_diff(row))
-
-    # Assign the calculated values to the DataFrame
-    final_df['Age'] = age
-    final_df['Semaine'] = semaine
-    final_df['Sem'] = sem
-    final_df['Temps_buvee'] = time_diff
+    # The curve is written as an integer whether or not the drinks had rows of other cows
+    final_df['Courbe'] = final_df['Courbe'].astype('Int64')
+
+    # Calculate age in days from the birth date and the passage date
+    final_df['Age'] = (final_df['debut'].dt.normalize() - final_df['Date_Naiss']).dt.days
+
+    # Calculate the week of life (1, 2, ...), written as s1, s2, ...
+    final_df['Week'] = ((final_df['Age'] / 7).round(1) + 1).astype(int)
+
+    # Calculate the drinking time of each passage
+    final_df['Temps_buvee'] = final_df['fin'] - final_df['debut']
     
-    final_df['ALIMENT'] = ""
     courbe_to_aliment = dict(zip(courbe, aliment))
     final_df['ALIMENT'] = final_df['Courbe'].map(courbe_to_aliment)
 
-    # Convert 'NUM' from float to int
-    final_df['NUM'] = final_df['NUM'].astype(int)
+    # Use the compact types (e.g. 'NUM' from float to int)
+    final_df = final_df.astype(PASSAGE_TYPES)
 
-    # Sort the DataFrame by 'NUM', 'Semaine', and 'Heure_debut'
-    final_df = final_df.sort_values(by=['NUM', 'Semaine', "Heure_debut"], ascending=[True, True, True])
+    # Sort the DataFrame by 'NUM', 'Age', and start time
+    final_df = final_df.sort_values(by=['NUM', 'Age', 'debut'], kind='stable')
 
     # Reorganize the columns according to the defined order
     final_df = final_df[column_order]
 
     # Reset the index of the DataFrame
     final_df.reset_index(drop=True, inplace=True)
-    
-    # Get the global data
-    all = data_global(zip_filename, start_date)
 
-    return final_df, all
+    return final_df
+
+def aggregate_days(passages, engine=None):
+    """
+    Sum the passages of each cow and day in a single pass.
+    The days are coded by one integer (cow, day of life): the sums and counts are made
+    by the engine (np.bincount with pandas), then the attributes of the cows are looked up
+    on one passage of each day.
+    Args:
+    - passages: DataFrame of the passages from build_passages.
+    - engine: Engine of the aggregation (see Engine.open_engine), pandas by default.
+    Returns:
+    - DataFrame with one row per cow and day, sorted by 'URBAN_ID' and 'Age', with the
+      cow attributes, 'Age', 'Week', 'DATE' and the totals 'Conso_lait', 'Temps_buvee' and 'Nombre_de_visites'.
+    """
+    # The days of cows without curve or feed are not aggregated
+    kept = np.flatnonzero(passages['Courbe'].notna().to_numpy() & passages['ALIMENT'].notna().to_numpy())
+
+    # Code the days by 'URBAN_ID' then day of life, the codes follow the order of the days
+    codes = day_codes(passages['URBAN_ID'].to_numpy()[kept], passages['Age'].to_numpy()[kept])
+
+    # Sum and count the passages of each day (missing values count as 0, like a groupby sum)
+    conso = passages['Conso_lait'].fillna(0).to_numpy(dtype=np.float64)[kept]
+    seconds = passages['Temps_buvee'].dt.total_seconds().fillna(0).to_numpy()[kept]
+    totals = open_engine(engine).sum_by_code(codes, {'Conso_lait': conso, 'seconds': seconds}, kept)
+
+    # Look up the attributes of the cows on one passage of each day, they are the same on every passage of a cow
+    days = passages[['URBAN_ID', 'NUM', 'Courbe', 'ALIMENT', 'Bande', 'Date_Naiss', 'Age', 'Week']].iloc[totals['row'].to_numpy()]
+    days = days.reset_index(drop=True)
 
-def par_jour(grouped, all, COURBE, conso_lait, visites):
+    # Add the date and the totals of each day
+    days['DATE'] = days['Date_Naiss'] + pd.to_timedelta(days['Age'].astype(np.int64), unit='D')
+    days['Conso_lait'] = totals['Conso_lait'].to_numpy()
+    days['Temps_buvee'] = pd.to_timedelta(totals['seconds'].to_numpy().round().astype(np.int64), unit='s')
+    days['Nombre_de_visites'] = totals['count'].to_numpy()
+
+    return days.drop(columns=['Date_Naiss'])
+
+def day_codes(animals, ages):
+    """
+    Code (cow, day of life) pairs by one integer, in the order of 'URBAN_ID' then day.
+    Args:
+    - animals: Array of URBAN_IDs.
+    - ages: Array of days of life.
+    Returns:
+    - Array of int64 codes.
+    """
+    ages = np.asarray(ages, dtype=np.int64)
+    first_age = ages.min() if len(ages) else 0
+    span = ages.max() - first_age + 1 if len(ages) else 1
+    return np.asarray(animals, dtype=np.int64) * span + (ages - first_age)
+
+def merge_days(parts, engine=None):
+    """
+    Add up the day totals of several parts of the passages (e.g. the blocks of a streamed export),
+    a day can have passages in several parts.
+    Args:
+    - parts: List of DataFrames from aggregate_days.
+    - engine: Engine of the aggregation (see Engine.open_engine), pandas by default.
+    Returns:
+    - DataFrame as returned by aggregate_days with all the passages.
+    """
+    # The parts can have different categories
+    days = pd.concat(parts, ignore_index=True)
+    days = days.astype({'Courbe': 'category', 'ALIMENT': 'category', 'Bande': 'category'})
+
+    # Add up the totals of each day
+    values = {
+        'Conso_lait': days['Conso_lait'].to_numpy(dtype=np.float64),
+        'seconds': days['Temps_buvee'].dt.total_seconds().to_numpy(),
+        'visits': days['Nombre_de_visites'].to_numpy(dtype=np.float64)
+    }
+    totals = open_engine(engine).sum_by_code(day_codes(days['URBAN_ID'], days['Age']), values, np.arange(len(days)))
+
+    merged = days.drop(columns=['Conso_lait', 'Temps_buvee', 'Nombre_de_visites'])
+    merged = merged.iloc[totals['row'].to_numpy()].reset_index(drop=True)
+    merged['Conso_lait'] = totals['Conso_lait'].to_numpy()
+    merged['Temps_buvee'] = pd.to_timedelta(totals['seconds'].to_numpy().round().astype(np.int64), unit='s')
+    merged['Nombre_de_visites'] = totals['visits'].to_numpy().round().astype(np.int64)
+    return merged
+
+def theoretical_table(COURBE, conso_lait, visites):
+    """
+    Build the lookup table of the theoretical values of each curve by week.
+    Args:
+    - COURBE: List of curves.
+    - conso_lait: List of theoretical milk consumption values by week, for each curve.
+    - visites: List of theoretical visit counts by week, for each curve.
+    Returns:
+    - DataFrame with one row per (Courbe, Week), weeks starting at 1.
+    """
+    rows = []
+    for courbe, litres, passages in zip(COURBE, conso_lait, visites):
+        # Weeks are kept only when both values are given
+        for week in range(min(len(litres), len(passages))):
+            rows.append((courbe, week + 1, float(litres[week]), float(passages[week])))
+    table = pd.DataFrame(rows, columns=['Courbe', 'Week', 'Conso_lait_theorique', 'Visites_theoriques'])
+
+    # When a curve is given twice, its last values are used
+    return table.drop_duplicates(subset=['Courbe', 'Week'], keep='last')
+
+def visits_per_day(all, engine=None):
+    """
+    Count the station visits without right (no milk given) of each cow per day.
+    Args:
+    - all: DataFrame of the station visits from visit_facts, or visits already counted by this function.
+    - engine: Engine of the aggregation (see Engine.open_engine), pandas by default.
+    Returns:
+    - DataFrame with 'URBAN_ID', 'DATE' and the number of visits without right in 'Nb_sans_droit'.
+    """
+    if 'Nb_sans_droit' in all.columns:
+        return all
+    all = all.assign(DATE=parse_dates(all['DATE']), Nb_sans_droit=~all['Lait'])
+    return open_engine(engine).sum_by(all, ['URBAN_ID', 'DATE'], ['Nb_sans_droit'])
+
+def par_jour(grouped, all, COURBE, conso_lait, visites, interpolation=False, engine=None):
     """
     Aggregate data on a per-day basis.
     Args:
-    - grouped: DataFrame containing grouped data.
-    - all: DataFrame containing all data.
+    - grouped: DataFrame of the passages from build_passages, or the day totals from aggregate_days or merge_days.
+    - all: DataFrame of the station visits from visit_facts, or the visits already counted by visits_per_day.
     - COURBE: List of curves.
     - conso_lait: List of theoretical milk consumption values.
     - visites: List of theoretical visit counts.
+    - interpolation: If True, the theoretical values change linearly from the first day of a week
+      to the first day of the next week instead of being constant over the week.
+    - engine: Engine of the joins and aggregations (see Engine.open_engine), pandas by default.
     Returns:
-    - Aggregated DataFrame with daily data.
+    - Aggregated DataFrame with daily data, with the week number in 'Week'.
     """
     # Define columns to keep
-    keep_columns = ['NUM', 'Bande', 'ALIMENT', 'JOUR', 'Sem', 'Conso_lait', 'Conso_lait_theorique',
+    keep_columns = ['NUM', 'Bande', 'ALIMENT', 'JOUR', 'Week', 'Conso_lait', 'Conso_lait_theorique',
                     'Ecart_conso_lait', 'Temps_buvee_total', 'Nombre_de_visites', 'Visites_theoriques',
                     'Ecart_visites', 'Nb_sans_droit']
 
-    # Convert 'Temps_buvee' to timedelta
-    grouped['Temps_buvee'] = pd.to_timedelta(grouped['Temps_buvee'])
-
-    # Aggregate data by 'URBAN_ID', 'NUM', 'Courbe', 'ALIMENT', 'Bande', 'Date_debut', 'Age', and 'Sem'
-    counts = grouped
-    grouped = grouped.groupby(['URBAN_ID', 'NUM', 'Courbe', 'ALIMENT', 'Bande', 'Date_debut', 'Age', 'Sem']).agg({
-        'Conso_lait': 'sum',
-        'Temps_buvee': 'sum'
-    }).reset_index()
-
-    # Count the number of visits
-    counts = counts.groupby(['NUM', 'Age']).size().reset_index(name='count')
-    grouped = pd.merge(grouped, counts, on=['NUM', 'Age'], how='left').rename(columns={'count': 'Nombre_de_visites'})
-
-    # Function to extract the week index from 'Sem'
-    def get_week_index(sem):
-        return int(sem[1:]) - 1  # Extract the index (s1 -> 0, s2 -> 1, etc.)
-
-    # Fill 'Conso_lait_theorique' and 'Visites_theoriques' columns
-    for i, courbe in enumerate(COURBE):
-        mask = grouped["Courbe"] == courbe
-        for index, row in grouped[mask].iterrows():
-            week_index = get_week_index(row["Sem"])
-            if week_index < len(conso_lait[i]) and week_index < len(visites[i]):
-                grouped.at[index, "Conso_lait_theorique"] = conso_lait[i][week_index]
-                grouped.at[index, "Visites_theoriques"] = visites[i][week_index]
+    # Sum the passages and count the visits of each cow and day
+    engine = open_engine(engine)
+    if 'Nombre_de_visites' not in grouped.columns:
+        grouped = aggregate_days(grouped, engine)
+
+    # Fill 'Conso_lait_theorique' and 'Visites_theoriques' columns from the lookup table
+    table = theoretical_table(COURBE, conso_lait, visites)
+    table['Courbe'] = table['Courbe'].astype('float64')
+    targets = grouped[['Courbe', 'Week', 'Age']].astype({'Courbe': 'float64', 'Week': 'int64'})
+    targets = targets.merge(table, on=['Courbe', 'Week'], how='left')
+    if interpolation:
+        # Keep the curve of each row and interpolate the values inside its week
+        for courbe, curve_table in table.groupby('Courbe'):
+            mask = (targets['Courbe'] == courbe).to_numpy() & targets['Conso_lait_theorique'].notna().to_numpy()
+            first_days = (curve_table['Week'].to_numpy() - 1) * 7
+            for column in ['Conso_lait_theorique', 'Visites_theoriques']:
+                targets.loc[mask, column] = np.interp(targets.loc[mask, 'Age'], first_days, curve_table[column].to_numpy())
+    grouped['Conso_lait_theorique'] = targets['Conso_lait_theorique'].to_numpy()
+    grouped['Visites_theoriques'] = targets['Visites_theoriques'].to_numpy()
 
     # Calculate differences between theoretical and actual values
     grouped['Ecart_conso_lait'] = grouped['Conso_lait_theorique'] - grouped['Conso_lait']
     grouped['Ecart_visites'] = grouped['Nombre_de_visites'] - grouped['Visites_theoriques']
 
-    # Format 'Temps_buvee' to HH:MM:SS
-    grouped['Temps_buvee'] = grouped['Temps_buvee'].apply(lambda x: '{:02}:{:02}:{:02}'.format(
-        int(x.total_seconds() // 3600), int((x.total_seconds() // 60) % 60), int(x.total_seconds() % 60)))
-    
     # Round numeric values to three decimal places
     grouped['Conso_lait_theorique'] = grouped['Conso_lait_theorique'].astype(float).round(3)
     grouped['Ecart_conso_lait'] = grouped['Ecart_conso_lait'].astype(float).round(3)
-    grouped['Ecart_visites'] = grouped['Ecart_visites'].astype(int).round(2)
+    # The visit gap is truncated to an integer, it is left empty for the days without
+    # theoretical values (a week beyond the lists or a curve missing from them)
+    grouped['Ecart_visites'] = np.trunc(grouped['Ecart_visites']).astype('Int64')
     grouped['Conso_lait'] = grouped['Conso_lait'].astype(float).round(3)
 
     # Rename 'Age' to 'JOUR' and 'Temps_buvee' to 'Temps_buvee_total'
     grouped = grouped.rename(columns={'Age': 'JOUR', 'Temps_buvee': 'Temps_buvee_total'})
 
     # Process the 'all' DataFrame for refusals
-    all['DATE'] = pd.to_datetime(all['DATE'])
-    all = all.groupby(['URBAN_ID', 'DATE']).size().reset_index(name='Nb_sans_droit')
-    grouped = grouped.rename(columns={'Date_debut': 'DATE'})
-    grouped['DATE'] = pd.to_datetime(grouped['DATE'])
-    grouped = pd.merge(grouped, all, on=['DATE', 'URBAN_ID'], how='left')
-    grouped['Nb_sans_droit'] = grouped['Nb_sans_droit'] - grouped['Nombre_de_visites']
+    all = visits_per_day(all, engine)
+    grouped = engine.join(grouped, all, ['DATE', 'URBAN_ID'], how='left')
 
     # Keep only specified columns
     grouped = grouped[keep_columns]
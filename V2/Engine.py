@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+# Optional multi-threaded engine, the pandas engine is used when pyarrow is not installed
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+class PandasEngine:
+    """
+    Reference engine of the joins and aggregations of the V2 pipeline, with eager pandas.
+    The transformations (Data, Output, utils) are written once and call their engine for
+    these operations. Every engine gives the same DataFrames, so the output files do not
+    depend on the engine.
+    """
+    name = 'pandas'
+
+    def join(self, left, right, on, how='inner'):
+        """
+        Join two DataFrames, keeping the order of the left rows.
+        Args:
+        - left: DataFrame.
+        - right: DataFrame, its key columns are not repeated in the result.
+        - on: Column or list of columns of the join.
+        - how: 'inner', or 'left' to keep the left rows without match (missing values on the right).
+        Returns:
+        - DataFrame with the columns of left then the other columns of right.
+        """
+        return left.merge(right, on=on, how=how)
+
+    def sum_by(self, df, keys, columns, count=None):
+        """
+        Sum columns by keys.
+        Args:
+        - df: DataFrame.
+        - keys: List of the key columns.
+        - columns: List of the columns to sum, missing values count as 0 (booleans are counted).
+        - count: Name of a column counting the rows of each key, None for no count.
+        Returns:
+        - DataFrame with the keys in sorted order and the sums.
+        """
+        grouped = df.groupby(keys, sort=True)
+        totals = grouped[columns].sum()
+        if count is not None:
+            totals[count] = grouped.size()
+        return totals.reset_index()
+
+    def sum_by_code(self, codes, values, rows):
+        """
+        Sum arrays by integer code, in a single pass over the rows.
+        Args:
+        - codes: Array of int64 codes of the groups.
+        - values: Dictionary of float64 arrays to sum, without missing values.
+        - rows: Array of the row positions, one is kept for each group.
+        Returns:
+        - DataFrame with one row per code in sorted order, the sums, the number of rows
+          in 'count' and a row position of the group in 'row'.
+        """
+        group, keys = pd.factorize(codes, sort=True)
+        size = len(keys)
+        totals = pd.DataFrame({name: np.bincount(group, weights=column, minlength=size) for name, column in values.items()})
+        totals['count'] = np.bincount(group, minlength=size)
+        first = np.zeros(size, dtype=np.int64)
+        first[group] = rows
+        totals['row'] = first
+        return totals
+
+class ArrowEngine(PandasEngine):
+    """
+    Multi-threaded engine: the joins and aggregations run in the Arrow compute engine (Acero)
+    on all the processors. Only the key and value columns are given to Arrow, the other
+    columns are gathered by row position, so their types are the ones of the pandas engine.
+    """
+    name = 'arrow'
+
+    @staticmethod
+    def key_array(values):
+        """Convert a key column to an Arrow array, the joined keys need the same type."""
+        values = pd.Series(values)
+        if pd.api.types.is_integer_dtype(values.dtype):
+            return pa.array(values.to_numpy(dtype=np.int64))
+        if pd.api.types.is_datetime64_dtype(values.dtype):
+            return pa.array(values.to_numpy(dtype='datetime64[ns]'))
+        return pa.array(values.to_numpy(dtype=object), from_pandas=True)
+
+    def join(self, left, right, on, how='inner'):
+        on = [on] if isinstance(on, str) else list(on)
+
+        # Join the keys and the row positions only
+        left_keys = pa.table({**{key: self.key_array(left[key]) for key in on}, '_left': np.arange(len(left))})
+        right_keys = pa.table({**{key: self.key_array(right[key]) for key in on}, '_right': np.arange(len(right))})
+        pairs = left_keys.join(right_keys, keys=on, join_type='inner' if how == 'inner' else 'left outer', use_threads=True)
+        pairs = pairs.sort_by([('_left', 'ascending'), ('_right', 'ascending')])
+
+        # Gather the rows, a left row without match gets missing values as with pandas
+        left_rows = pairs['_left'].to_numpy()
+        right_rows = pairs['_right'].fill_null(-1).to_numpy()
+        joined = left.iloc[left_rows].reset_index(drop=True)
+        others = [column for column in right.columns if column not in on]
+        if how == 'inner':
+            gathered = right[others].iloc[right_rows].reset_index(drop=True)
+        else:
+            gathered = right[others].reset_index(drop=True).reindex(right_rows).reset_index(drop=True)
+        return pd.concat([joined, gathered], axis=1)
+
+    def sum_by(self, df, keys, columns, count=None):
+        # Group the keys and the values in Arrow, booleans are summed as integers
+        sums = {column: df[column].fillna(0).to_numpy(dtype=np.int64 if df[column].dtype == bool else None)
+                for column in columns}
+        table = pa.table({**{key: pa.array(df[key].to_numpy(), from_pandas=True) for key in keys}, **sums})
+        aggregations = [(column, 'sum') for column in columns] + ([(keys[0], 'count')] if count is not None else [])
+        grouped = table.group_by(keys, use_threads=True).aggregate(aggregations)
+        grouped = grouped.sort_by([(key, 'ascending') for key in keys])
+
+        totals = pd.DataFrame({key: grouped[key].to_pandas() for key in keys})
+        totals = totals.astype({key: df[key].dtype for key in keys})
+        for column in columns:
+            totals[column] = grouped[f'{column}_sum'].to_numpy()
+        if count is not None:
+            totals[count] = grouped[f'{keys[0]}_count'].to_numpy().astype(np.int64)
+        return totals
+
+    def sum_by_code(self, codes, values, rows):
+        table = pa.table({'code': np.asarray(codes, dtype=np.int64), 'row': np.asarray(rows, dtype=np.int64), **values})
+        aggregations = [(name, 'sum') for name in values] + [('row', 'min'), ('row', 'count')]
+        grouped = table.group_by('code', use_threads=True).aggregate(aggregations).sort_by('code')
+
+        totals = pd.DataFrame({name: grouped[f'{name}_sum'].to_numpy() for name in values})
+        totals['count'] = grouped['row_count'].to_numpy().astype(np.int64)
+        totals['row'] = grouped['row_min'].to_numpy()
+        return totals
+
+# Engines by name, chosen with the 'engine' setting of the configuration
+ENGINES = {'pandas': PandasEngine, 'arrow': ArrowEngine}
+
+def open_engine(engine=None):
+    """
+    Get an engine from its name.
+    Args:
+    - engine: Name of the engine (key of ENGINES), an engine, or None for the pandas engine.
+    Returns:
+    - The engine. Without pyarrow, the pandas engine is used instead of the Arrow engine.
+    """
+    if engine is None:
+        return PandasEngine()
+    if not isinstance(engine, str):
+        return engine
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    if engine == 'arrow' and pa is None:
+        return PandasEngine()
+    return ENGINES[engine]()
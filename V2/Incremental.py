@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from Data import DAILY_TYPES, PASSAGE_TYPES, build_passages, par_jour, visits_per_day
+from Engine import open_engine
+from utils import animal_caract, animal_data, open_export, parse_dates, station_name, visit_facts, visit_milk
+
+# The states are written in Feather format, it needs pyarrow
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Default folder of the incremental states, it can be set with an environment variable
+DEFAULT_DIRECTORY = os.environ.get('DAL_STATE_DIR', os.path.join(os.path.expanduser('~'), '.dal_state'))
+
+# Change this version when the saved frames change, old states are then ignored
+STATE_VERSION = 4
+
+# Members with increasing ids, one getting smaller means that the DAL database was reset
+MARKED_MEMBERS = ('drinks', 'visits')
+
+class IncrementalStore:
+    """
+    Results already computed for the exports of one station.
+    The DAL keeps the whole history in every export, but the consumption ids
+    (verbrauch_milch_id) and visit ids (stationsbesuch_id) always increase. The
+    store remembers the highest ids already processed (high-water marks), the
+    passages, the visits without right counted per day, the visits still without
+    consumption and the daily data, so that a new export only reads the rows above
+    the high-water marks.
+    Args:
+    - station: Name of the station (see utils.station_name).
+    - directory: Folder of the states of all the stations.
+    """
+    FILES = ('passages', 'visits', 'refusals', 'daily')
+
+    def __init__(self, station, directory=None):
+        self.station = station
+        self.folder = os.path.join(directory or DEFAULT_DIRECTORY, station)
+
+    @staticmethod
+    def available():
+        """Return True if pyarrow is installed, the states cannot be saved otherwise."""
+        return feather is not None
+
+    def load(self, config):
+        """
+        Load the state of the station.
+        Args:
+        - config: Key of the session settings, the state is ignored if they changed.
+        Returns:
+        - (marks, frames): high-water marks and DataFrames by name, or (None, None) without a valid state.
+        """
+        if not self.available():
+            return None, None
+        try:
+            with open(os.path.join(self.folder, 'state.json'), 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            if state['config'] != config:
+                return None, None
+            frames = {name: feather.read_table(os.path.join(self.folder, f'{name}.feather')).to_pandas()
+                      for name in self.FILES}
+        except (OSError, ValueError, KeyError):
+            return None, None
+        return state['marks'], frames
+
+    def save(self, config, marks, frames):
+        """
+        Save the state of the station, the state file is written last.
+        Args:
+        - config: Key of the session settings.
+        - marks: Highest consumption and visit ids processed, and the sizes of the members.
+        - frames: DataFrames by name ('passages', 'visits', 'refusals', 'daily').
+        Returns:
+        - None
+        """
+        if not self.available():
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        for name in self.FILES:
+            frames[name].reset_index(drop=True).to_feather(os.path.join(self.folder, f'{name}.feather'),
+                                                           compression='uncompressed')
+        with open(os.path.join(self.folder, 'state.json'), 'w', encoding='utf-8') as file:
+            json.dump({'config': config, 'marks': marks}, file)
+
+def max_id(ids, mark=-1):
+    """Return the highest id of a column, mark if it is empty or lower."""
+    return max(int(ids.max()), mark) if len(ids) else mark
+
+def cow_rows(keys, cows):
+    """
+    Find the rows of some cows in a frame sorted by cow, by bisection.
+    Args:
+    - keys: Sorted numpy array of the cow key of each row.
+    - cows: Keys of the cows to find.
+    Returns:
+    - numpy array of the row positions, in the order of the frame.
+    """
+    cows = np.unique(cows)
+    first, last = np.searchsorted(keys, cows, side='left'), np.searchsorted(keys, cows, side='right')
+    lengths = last - first
+    # Consecutive positions of each block, without a loop over the cows
+    return np.repeat(first - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+def merge_cows(old, new, by, rank, replaced=None):
+    """
+    Merge new rows into a frame sorted by cow, sorting again only the rows of the cows that
+    get new rows. The other cows are copied as they are, the new rows come after the old
+    rows with the same keys, as with a stable sort of both frames.
+    Args:
+    - old: DataFrame sorted by cow, then by the columns of by.
+    - new: DataFrame with the same columns.
+    - by: Columns sorting the rows of a cow.
+    - rank: Function giving the cow key of each 'NUM' as a numpy array, in the order of the cows.
+    - replaced: DataFrame of 'NUM' and by keys whose old rows are dropped, None to keep every old row.
+    Returns:
+    - DataFrame sorted as old, with a new index.
+    """
+    old_keys = rank(old['NUM'])
+    cows = rank(new['NUM']) if replaced is None else np.concatenate([rank(new['NUM']), rank(replaced['NUM'])])
+    rows = cow_rows(old_keys, cows)
+    changed = old.iloc[rows]
+    if replaced is not None:
+        keys = ['NUM', *by]
+        changed = changed[~pd.MultiIndex.from_frame(changed[keys]).isin(pd.MultiIndex.from_frame(replaced[keys]))]
+    changed = pd.concat([changed, new], ignore_index=True)
+    changed = changed.assign(_rank=rank(changed['NUM'])).sort_values(by=['_rank', *by], kind='stable')
+    changed_keys = changed.pop('_rank').to_numpy()
+
+    unchanged = np.ones(len(old), dtype=bool)
+    unchanged[rows] = False
+    kept = old[unchanged]
+
+    # Each block of changed rows goes before the first kept row of a later cow
+    positions = np.searchsorted(old_keys[unchanged], changed_keys) + np.arange(len(changed))
+    order = np.empty(len(kept) + len(changed), dtype=np.int64)
+    order[positions] = np.arange(len(kept), len(order))
+    rest = np.ones(len(order), dtype=bool)
+    rest[positions] = False
+    order[rest] = np.arange(len(kept))
+    return pd.concat([kept, changed], ignore_index=True).take(order).reset_index(drop=True)
+
+def session_key(cows_id, courbe, aliment, COURBE, conso_lait, visites, interpolation):
+    """
+    Build the key of the session settings: any change forces a full computation.
+    Args:
+    - cows_id: DataFrame of the cows of the session from animal_caract.
+    - courbe, aliment: Lists of curves and corresponding feeds.
+    - COURBE, conso_lait, visites, interpolation: Theoretical values given to par_jour.
+    Returns:
+    - Hexadecimal string.
+    """
+    settings = [STATE_VERSION, courbe, aliment, COURBE, conso_lait, visites, interpolation]
+    digest = hashlib.sha1(json.dumps(settings, default=str).encode())
+    # The cows of the session are part of the key, a new or modified cow restarts the computation
+    digest.update(cows_id[['URBAN_ID', 'NUM', 'Date_Naiss', 'Courbe']].to_csv(index=False).encode())
+    return digest.hexdigest()
+
+def refused_visits(all):
+    """
+    Keep the station visits without consumption, they can still get one in a later export.
+    Args:
+    - all: DataFrame of the station visits from visit_facts.
+    Returns:
+    - DataFrame with 'ID_visite', 'URBAN_ID' and the day of the visit in 'DATE'.
+    """
+    refused = all.loc[~all['Lait'].to_numpy(), ['ID_visite', 'URBAN_ID', 'DATE']]
+    return refused.assign(DATE=parse_dates(refused['DATE'])).reset_index(drop=True)
+
+def par_passage_incremental(zip_filename, courbe, aliment, COURBE, conso_lait, visites,
+                            start_date="2000-01-01", end_date="3000-01-01", interpolation=False,
+                            station=None, directory=None, engine=None):
+    """
+    Compute the passages and the daily data of an export, reading only the rows
+    newer than the previous export of the same station.
+    Args:
+    - zip_filename: Path to the zip file, or a DalExport.
+    - courbe: List of curves.
+    - aliment: List of corresponding feeds.
+    - COURBE: List of curves of the theoretical values.
+    - conso_lait: List of theoretical milk consumption values.
+    - visites: List of theoretical visit counts.
+    - start_date: Start date for the data extraction.
+    - end_date: End date for the data extraction.
+    - interpolation: Interpolation of the theoretical values (see par_jour).
+    - station: Name of the station, taken from the zip file name by default.
+    - directory: Folder of the incremental states.
+    - engine: Engine of the joins and aggregations (see Engine.open_engine), pandas by default.
+    Returns:
+    - (passages, daily): the same DataFrames as par_passage and par_jour.
+    """
+    with open_export(zip_filename) as export:
+        engine = open_engine(engine)
+        store = IncrementalStore(station or station_name(export.zip_filename), directory)
+        if not store.available():
+            print("The incremental states need pyarrow, the whole export is processed")
+
+        cows_id = animal_caract(export, start_date, end_date)
+        animals = cows_id['URBAN_ID']
+        config = session_key(cows_id, courbe, aliment, COURBE, conso_lait, visites, interpolation)
+        marks, frames = store.load(config)
+        sizes = {member: export.member_size(member) for member in MARKED_MEMBERS}
+
+        # A full computation is needed without a state, or if a member got smaller (the DAL database was reset)
+        if marks is None or any(sizes[member] < marks['sizes'][member] for member in MARKED_MEMBERS):
+            drinks = animal_data(export, animals)
+            all = visit_facts(export, start_date, animals, engine, visit_milk(drinks, engine))
+            passages = build_passages(cows_id, drinks, courbe, aliment, engine)
+            counts = visits_per_day(all, engine)
+            refusals = refused_visits(all)
+            daily = par_jour(passages, counts, COURBE, conso_lait, visites, interpolation, engine)
+            new_marks = {'drinks': max_id(drinks['ID_conso']), 'visits': max_id(all['ID_visite']), 'sizes': sizes}
+            store.save(config, new_marks,
+                       {'passages': passages, 'visits': counts, 'refusals': refusals, 'daily': daily})
+            return passages, daily
+
+        # Read only the rows above the high-water marks, the other rows are dropped while reading
+        drinks = animal_data(export, animals, after={'ID_conso': marks['drinks']})
+        milk = visit_milk(drinks, engine)
+        new_visits = visit_facts(export, start_date, animals, engine, milk, after={'ID_visite': marks['visits']})
+        new_passages = build_passages(cows_id, drinks, courbe, aliment, engine)
+
+        # The passages are sorted by cow, day and time: only the cows with new passages are sorted again
+        by_num = lambda nums: nums.to_numpy()
+        passages = merge_cows(frames['passages'], new_passages, ['Age', 'debut'], by_num).astype(PASSAGE_TYPES)
+
+        # A visit counted without right in a previous export can get its consumption in this one
+        # (e.g. the calf was still in the station): it is removed from the count of its day
+        refusals = frames['refusals']
+        served = refusals['ID_visite'].isin(milk['ID_visite']).to_numpy()
+        served_days = refusals.loc[served, ['URBAN_ID', 'DATE']].assign(Nb_sans_droit=-1)
+        refusals = pd.concat([refusals[~served], refused_visits(new_visits)], ignore_index=True)
+
+        # Add the new visits to the counts of the days already seen
+        new_counts = visits_per_day(new_visits, engine)
+        counts = pd.concat([frames['visits'], new_counts, served_days], ignore_index=True)
+        counts = counts.groupby(['URBAN_ID', 'DATE'], as_index=False, sort=False)['Nb_sans_droit'].sum()
+
+        # Days to compute again: days with new passages, new visits or visits that got their consumption
+        visit_days = pd.concat([new_counts[['URBAN_ID', 'DATE']], served_days[['URBAN_ID', 'DATE']]])
+        visit_days = visit_days.merge(cows_id[['URBAN_ID', 'NUM', 'Date_Naiss']], on='URBAN_ID')
+        visit_days['Age'] = (visit_days['DATE'] - visit_days['Date_Naiss']).dt.days
+        days = pd.concat([new_passages[['NUM', 'Age']], visit_days[['NUM', 'Age']]]).drop_duplicates()
+
+        # Only the passages of the cows of these days are looked at
+        candidates = passages.iloc[cow_rows(by_num(passages['NUM']), by_num(days['NUM']))]
+        in_days = pd.MultiIndex.from_frame(candidates[['NUM', 'Age']]).isin(pd.MultiIndex.from_frame(days))
+        new_daily = par_jour(candidates[in_days], counts, COURBE, conso_lait, visites, interpolation, engine)
+
+        # Replace the computed days in the previous daily data, in the order of par_jour (cow, then day)
+        cows = cows_id.drop_duplicates('NUM')[['URBAN_ID', 'NUM']].sort_values(by=['URBAN_ID', 'NUM'], kind='stable')
+        positions = pd.Series(np.arange(len(cows)), index=cows['NUM'])
+        by_cow = lambda nums: nums.map(positions).to_numpy()
+        replaced = days.rename(columns={'Age': 'JOUR'})
+        daily = merge_cows(frames['daily'], new_daily, ['JOUR'], by_cow, replaced).astype(DAILY_TYPES)
+
+        new_marks = {'drinks': max_id(drinks['ID_conso'], marks['drinks']),
+                     'visits': max_id(new_visits['ID_visite'], marks['visits']), 'sizes': sizes}
+        store.save(config, new_marks, {'passages': passages, 'visits': counts, 'refusals': refusals, 'daily': daily})
+
+        return passages, daily
@@ -1,13 +1,59 @@
-import pandas as pd
 from Data import par_jour, par_passage
-from utils import data_cleaned_without_week, save_dataframe
+from utils import data_cleaned_without_week, format_dates, format_times, save_dataframe
+
+def pao(df):
+    """
+    Write the labels of the passages for the DB_PAO export.
+    
+    Args:
+    - df (pandas.DataFrame): The passages from par_passage.
+
+    Returns:
+    - pandas.DataFrame: The passages with their weeks, dates and times as written in DB_PAO.
+    """
+    
+    # Define the order of columns of DB_PAO
+    keep_columns = [
+        "URBAN_ID", "NUM", "Bande", "Courbe", "ALIMENT", "Date_Naiss", "Age", "Semaine", "Sem",
+        "Prog_lait", "Conso_lait", "Conso_mat1", "Conso_mat2", "Conso_eau",
+        "Date_debut", "Heure_debut", "Date_fin", "Heure_fin", "Temps_buvee"
+    ]
+    
+    # Write the week of life and its label (s1, s2, ...)
+    df = df.assign(Semaine=(df['Age'] / 7).round(1), Sem="s" + df['Week'].astype(str))
+    
+    # Split the start and end of the passages into date and time columns
+    df = df.assign(
+        Date_Naiss=format_dates(df['Date_Naiss'], '%Y-%m-%d'),
+        Date_debut=format_dates(df['debut'].dt.normalize(), '%Y-%m-%d'),
+        Heure_debut=format_times(df['debut']),
+        Date_fin=format_dates(df['fin'].dt.normalize(), '%Y-%m-%d'),
+        Heure_fin=format_times(df['fin'])
+    )
+    
+    return df[keep_columns]
+
+def statistiques(df):
+    """
+    Write the labels of the daily data for the Statistiques export.
+    
+    Args:
+    - df (pandas.DataFrame): The daily data from par_jour.
+
+    Returns:
+    - pandas.DataFrame: The daily data with the week labels (s1, s2, ...) in 'Sem'.
+    """
+    
+    # Replace the week number by its label, at the same place
+    df = df.assign(Week="s" + df['Week'].astype(str))
+    return df.rename(columns={'Week': 'Sem'})
 
 def sicpa(df, farm):
     """
     Process the DataFrame for SICPA export with specific formatting and renaming.
     
     Args:
-    - df (pandas.DataFrame): The input DataFrame with raw data.
+    - df (pandas.DataFrame): The passages from par_passage.
     - farm (str): The prefix to prepend to the animal numbers.
 
     Returns:
@@ -23,23 +69,17 @@ def sicpa(df, farm):
         # Columns 'DISTRIBUTEUR', 'ALIMENT', 'ENTREE' will be added later
     }
     
-    # Rename columns in the DataFrame based on rename_dict
-    df.rename(columns=rename_dict, inplace=True)
+    # Rename columns in the DataFrame based on rename_dict (the input DataFrame is not modified)
+    df = df.rename(columns=rename_dict)
     
     # Add a constant value 'DAL' to the 'DISTRIBUTEUR' column
     df['DISTRIBUTEUR'] = 'PAO_BOV_DAL_001'
     
-    # Combine 'Date_debut' and 'Heure_debut' into a single 'ENTREE' column
-    df['ENTREE'] = df['Date_debut'] + ' ' + df['Heure_debut']
-    
-    # Convert the combined 'ENTREE' column to datetime format and then to string
-    df['ENTREE'] = pd.to_datetime(df['ENTREE'], format='%Y-%m-%d %H:%M:%S')
-    df['ENTREE'] = df['ENTREE'].dt.strftime('%d/%m/%Y %H:%M:%S')
+    # Write the start of the passage as the 'ENTREE' column (each date and time of day is formatted once)
+    df['ENTREE'] = format_dates(df['debut'].dt.normalize(), '%d/%m/%Y') + ' ' + format_times(df['debut'])
     
     # Modify 'ANIMAL' numbers: prepend the farm prefix and convert to string
-    df['ANIMAL'] = df['ANIMAL'].apply(lambda x: farm + str(x))
-    df['DUREE'] = df['DUREE'].apply(lambda x: '{:02}:{:02}:{:02}'.format(
-        int(x.total_seconds() // 3600), int((x.total_seconds() // 60) % 60), int(x.total_seconds() % 60)))
+    df['ANIMAL'] = farm + df['ANIMAL'].astype(str)
     # Define the columns to keep in the final DataFrame
     keep_columns = ['DISTRIBUTEUR', 'ANIMAL', 'ALIMENT', 'ENTREE', 'DUREE', 'QUANTITE', 'CONSIGNE']
     
@@ -53,15 +93,15 @@ def sem_comp_jour(df, nb):
     Clean the DataFrame to retain only weeks with at least `nb` days of data.
 
     Args:
-    - df (pandas.DataFrame): The initial DataFrame containing daily data.
+    - df (pandas.DataFrame): The daily data from par_jour.
     - nb (int): The number of weeks required to keep in the DataFrame.
 
     Returns:
-    - pandas.DataFrame: The cleaned DataFrame with only the specified weeks of data.
+    - pandas.DataFrame: The cleaned DataFrame with only the specified weeks of data, labelled as in Statistiques.
     """
     # Clean the DataFrame to remove weeks with less than the required number of days
     df = data_cleaned_without_week(df, nb)
-    return df
+    return statistiques(df)
 
 if __name__ == "__main__":
     # Path to the ZIP file containing raw data
@@ -99,14 +139,14 @@ if __name__ == "__main__":
     print("data par passage\n", data)
     
     # Save the passage data to a CSV file
-    save_dataframe(data, r"data\DB_PAO.csv")
+    save_dataframe(pao(data), r"data\DB_PAO.csv")
 
     # Process the data for each day
     data_day = par_jour(data, all_data, Courbe, conso_lait, visites)
     print("data par day\n", data_day)
     
     # Save the daily data to a CSV file
-    save_dataframe(data_day, r"data\Statistiques.csv")
+    save_dataframe(statistiques(data_day), r"data\Statistiques.csv")
 
     # Prepare the data for SICPA export
     Sicpa = sicpa(data, farm)
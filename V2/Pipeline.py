@@ -0,0 +1,150 @@
+import contextlib
+from Data import build_passages, par_jour
+from Engine import open_engine
+from Output import pao, sicpa, sem_comp_jour, statistiques
+from utils import animal_caract, animal_data, open_export, visit_facts
+
+# Steps of the pipeline: name -> (steps it depends on, function computing it from the pipeline)
+STEPS = {
+    'cows': ([], lambda p: animal_caract(p.export, p.start_date, p.end_date)),
+    'drinks': (['cows'], lambda p: animal_data(p.export, p.get('cows')['URBAN_ID'])),
+    'visits': (['cows'], lambda p: visit_facts(p.export, p.start_date, p.get('cows')['URBAN_ID'], p.engine)),
+    'passages': (['cows', 'drinks'], lambda p: build_passages(p.get('cows'), p.get('drinks'), p.courbe, p.aliment,
+                                                              p.engine)),
+    'daily': (['passages', 'visits'], lambda p: par_jour(p.get('passages'), p.get('visits'), p.courbe,
+                                                         p.conso_lait, p.visites, p.interpolation, p.engine)),
+    'pao': (['passages'], lambda p: pao(p.get('passages'))),
+    'statistiques': (['daily'], lambda p: statistiques(p.get('daily'))),
+    'sicpa': (['passages'], lambda p: sicpa(p.get('passages'), p.ipg)),
+    'complete_weeks': (['daily'], lambda p: sem_comp_jour(p.get('daily'), p.weeks))
+}
+
+# Output files: name -> (step giving the data, file name)
+OUTPUTS = {
+    'pao': ('pao', 'DB_PAO.csv'),
+    'sicpa': ('sicpa', 'SICPA.csv'),
+    'statistiques': ('statistiques', 'Statistiques.csv'),
+    'semaines_completes': ('complete_weeks', 'Semaines_completes.csv')
+}
+
+class Pipeline:
+    """
+    Lazy evaluation of the V2 outputs of one export.
+    Each step is computed only when an output needs it, and at most once. For example,
+    the SICPA output only needs the passages, so the station visits (nr_01) are never read.
+    A session opened from a path is closed by close() or at the end of a `with` block.
+    Args:
+    - zip_filename: Path to the zip file, or a DalExport.
+    - courbe: List of curves.
+    - aliment: List of corresponding feeds.
+    - conso_lait: List of theoretical milk consumption values.
+    - visites: List of theoretical visit counts.
+    - start_date: First birth date of the cows.
+    - end_date: Last birth date of the cows.
+    - ipg: Farm prefix of the SICPA animal numbers.
+    - weeks: Number of weeks of the experiment, for the complete weeks.
+    - interpolation: Interpolation of the theoretical values (see par_jour).
+    - engine: Engine of the joins and aggregations, 'pandas' or 'arrow' (see Engine.open_engine).
+    """
+    def __init__(self, zip_filename, courbe, aliment, conso_lait, visites, start_date="2000-01-01",
+                 end_date="3000-01-01", ipg="", weeks=None, interpolation=False, engine='pandas'):
+        self._exports = contextlib.ExitStack()
+        self.export = self._exports.enter_context(open_export(zip_filename))
+        self.courbe = courbe
+        self.aliment = aliment
+        self.conso_lait = conso_lait
+        self.visites = visites
+        self.start_date = start_date
+        self.end_date = end_date
+        self.ipg = ipg
+        self.weeks = len(conso_lait[0]) if weeks is None and conso_lait else weeks
+        self.interpolation = interpolation
+        self.engine = open_engine(engine)
+        self.on_step = None
+        self.report = None
+        self._results = {}
+
+    def close(self):
+        """Close the export session if the pipeline opened it, the results stay available."""
+        self._exports.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def plan(self, outputs):
+        """
+        List the steps needed by the outputs, each after the steps it depends on.
+        Args:
+        - outputs: List of output names (keys of OUTPUTS).
+        Returns:
+        - List of step names.
+        """
+        order = []
+
+        def visit(step):
+            if step in order:
+                return
+            for dependency in STEPS[step][0]:
+                visit(dependency)
+            order.append(step)
+
+        for output in outputs:
+            visit(OUTPUTS[output][0])
+        return order
+
+    def get(self, step):
+        """
+        Get the result of a step, computing it and its dependencies on first use.
+        Args:
+        - step: Name of the step (key of STEPS).
+        Returns:
+        - DataFrame of the step.
+        """
+        if step not in self._results:
+            dependencies, function = STEPS[step]
+            for dependency in dependencies:
+                self.get(dependency)
+            if self.on_step is not None:
+                self.on_step(step)
+            if self.report is None:
+                self._results[step] = function(self)
+                return self._results[step]
+
+            # Measure the step, its rows in are the rows of its dependencies
+            rows_in = sum(len(self._results[dependency]) for dependency in dependencies) if dependencies else None
+            with self.report.stage(step, rows_in) as record:
+                self._results[step] = function(self)
+                record['rows_out'] = len(self._results[step])
+        return self._results[step]
+
+    def set(self, step, data):
+        """
+        Give the result of a step computed elsewhere (e.g. by the incremental mode), it is then not computed.
+        Args:
+        - step: Name of the step (key of STEPS).
+        - data: DataFrame of the step.
+        Returns:
+        - None
+        """
+        self._results[step] = data
+
+    def run(self, outputs, on_step=None, report=None):
+        """
+        Compute the selected outputs only.
+        Args:
+        - outputs: List of output names (keys of OUTPUTS).
+        - on_step: Function called with the name of each step before it is computed.
+        - report: RunReport measuring each computed step, None for no measures.
+        Returns:
+        - Dictionary of the DataFrames by output name.
+        """
+        self.on_step = on_step
+        self.report = report
+        try:
+            return {output: self.get(OUTPUTS[output][0]) for output in outputs}
+        finally:
+            self.on_step = None
+            self.report = None
@@ -0,0 +1,187 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from utils import save_dataframes
+
+# Optional reader of the process memory, /proc is read on Linux when it is not installed
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Files written next to the outputs
+REPORT_FILE = 'run_report.json'
+PROFILE_FILE = 'run_profile.prof'
+
+# Interval of the memory samples during a stage, in seconds
+SAMPLE_INTERVAL = 0.05
+
+def memory_usage():
+    """
+    Get the resident memory of the process.
+    Returns:
+    - Size in bytes, None when it cannot be read (without psutil outside Linux).
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MemorySampler:
+    """
+    Peak of the resident memory of the process while a block runs, sampled in a thread.
+    Unlike tracemalloc, the sampling does not slow down the block and it sees the memory
+    of numpy and Arrow.
+    Args:
+    - interval: Time between two samples, in seconds.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Update the peak with the current memory."""
+        usage = memory_usage()
+        if usage is not None and (self.peak is None or usage > self.peak):
+            self.peak = usage
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self.sample()
+        return False
+
+class RunReport:
+    """
+    Measures of a run of the V2 pipeline, stage by stage: wall time, CPU time of the
+    process (all threads), rows in and out, and memory peak.
+    The run is measured inside a `with` block, each stage inside a `stage` block.
+    Args:
+    - source: Path of the processed export.
+    - profile: True to also profile the run with cProfile (slower), saved next to the report.
+    """
+    def __init__(self, source=None, profile=False):
+        self.source = source
+        self.profiler = cProfile.Profile() if profile else None
+        self.stages = []
+        self.started = None
+        self.total = {}
+        self._sampler = None
+        self._start = None
+
+    def __enter__(self):
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self._sampler = MemorySampler().__enter__()
+        self._start = (time.perf_counter(), time.process_time())
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self._sampler.__exit__(*exc)
+        self.total = self.measures(self._start, self._sampler)
+        return False
+
+    @staticmethod
+    def measures(start, sampler):
+        """Wall time, CPU time and memory peak since start, rounded for the report."""
+        wall, cpu = start
+        return {
+            'wall_s': round(time.perf_counter() - wall, 4),
+            'cpu_s': round(time.process_time() - cpu, 4),
+            'peak_mb': None if sampler.peak is None else round(sampler.peak / 1e6, 1)
+        }
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Measure a stage of the run.
+        Args:
+        - name: Name of the stage (e.g. a step of Pipeline).
+        - rows_in: Number of rows given to the stage, None if it reads the export.
+        Returns:
+        - The record of the stage, the block sets its 'rows_out'.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        start = (time.perf_counter(), time.process_time())
+        with MemorySampler() as sampler:
+            yield record
+        record.update(self.measures(start, sampler))
+        self.stages.append(record)
+
+    def to_dict(self):
+        """
+        Get the report as a dictionary.
+        Returns:
+        - Dictionary with the source, the start time, the totals and the list of the stages.
+        """
+        return {'source': self.source, 'started': self.started, **self.total, 'stages': self.stages}
+
+    def save(self, folder):
+        """
+        Write the report (and the profile, if any) in a folder.
+        Args:
+        - folder: Folder of the outputs of the run.
+        Returns:
+        - str: The path of the JSON report.
+        """
+        report = self.to_dict()
+        if self.profiler is not None:
+            self.profiler.dump_stats(os.path.join(folder, PROFILE_FILE))
+            report['profile'] = PROFILE_FILE
+        path = os.path.join(folder, REPORT_FILE)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        return path
+
+def save_measured(files, report=None):
+    """
+    Save several DataFrames to CSV files in parallel (see save_dataframes), measured as
+    the 'write' stage of a report.
+    Args:
+    - files: List of (DataFrame, path) pairs.
+    - report: RunReport of the run, None for no measures.
+    Returns:
+    - list: The paths of the written files, in the order of files (None for a failed file).
+    """
+    if report is None:
+        return save_dataframes(files)
+    with report.stage('write', sum(len(df) for df, _ in files)) as record:
+        paths = save_dataframes(files)
+        record['rows_out'] = sum(len(df) for (df, _), path in zip(files, paths) if path is not None)
+    return paths
+
+def measured(report):
+    """
+    Get the stage function of a report, or one measuring nothing.
+    Args:
+    - report: RunReport, or None.
+    Returns:
+    - Function (name, rows_in=None) -> context manager giving the record of the stage.
+    """
+    if report is not None:
+        return report.stage
+    return lambda name, rows_in=None: contextlib.nullcontext({})
@@ -0,0 +1,187 @@
+import heapq
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from Data import aggregate_days, build_passages, merge_days, par_jour
+from Engine import open_engine
+from Output import pao, sicpa, sem_comp_jour, statistiques
+from Report import measured, save_measured
+from utils import animal_caract, format_durations, iter_animal_data, open_export, save_file, visit_facts, visit_milk
+
+# Exports with a larger consumption file (nr_03, in bytes once unzipped) are streamed
+STREAM_THRESHOLD = 1024 ** 3
+
+# Number of rows of the consumption file read at once when streaming
+STREAM_CHUNKSIZE = 500000
+
+# Steps of the streaming mode, in the order they are reported
+STREAM_STEPS = ['cows', 'passages', 'write', 'visits', 'daily', 'complete_weeks']
+
+# Outputs written block by block: name -> function labelling the passages of a block
+PASSAGE_OUTPUTS = {
+    'pao': lambda passages, ipg: pao(passages),
+    'sicpa': lambda passages, ipg: sicpa(passages, ipg)
+}
+
+def needs_streaming(zip_filename, threshold=STREAM_THRESHOLD):
+    """
+    Check if an export is too large to be processed in memory.
+    Args:
+    - zip_filename: Path to the zip file or a DalExport.
+    - threshold: Size of the consumption file (bytes) above which the export is streamed.
+    Returns:
+    - True if the export should be processed with stream_export.
+    """
+    with open_export(zip_filename) as export:
+        return export.member_size('drinks') > threshold
+
+def write_run(frame, passages, path):
+    """
+    Write a block of an output as a sorted run, each line starting with its sort keys.
+    Args:
+    - frame: Labelled output of the block (e.g. from pao), one row per passage.
+    - passages: Passages of the block from build_passages, sorted by cow, day and time.
+    - path: Path of the run file.
+    Returns:
+    - None
+    """
+    keys = pd.DataFrame({
+        'NUM': passages['NUM'].to_numpy(dtype=np.int64),
+        'Age': passages['Age'].to_numpy(dtype=np.int64),
+        'debut': passages['debut'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    })
+    frame = format_durations(frame).reset_index(drop=True)
+    pd.concat([keys, frame], axis=1).to_csv(path, index=False, header=False, sep=';')
+
+def read_run(path):
+    """
+    Read the lines of a run with their sort keys.
+    Args:
+    - path: Path of the run file from write_run.
+    Returns:
+    - Iterator of ((NUM, Age, debut), line) pairs.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        for line in file:
+            num, age, debut, row = line.split(';', 3)
+            yield (int(num), int(age), int(debut)), row
+
+def merge_runs(paths, columns, chemin):
+    """
+    Merge sorted runs into one CSV file. Equal keys keep the order of the runs, so the
+    lines are in the order of a stable sort of all the blocks.
+    Args:
+    - paths: List of the run files, in the order of the blocks.
+    - columns: Column names of the output.
+    - chemin: Path of the output file, saved as with save_dataframe (a locked file is kept
+      next to it under another name).
+    Returns:
+    - str: The path of the written file, None if nothing could be written.
+    """
+    def write(path):
+        pd.DataFrame(columns=columns).to_csv(path, index=False, sep=';')
+        with open(path, 'a', encoding='utf-8', newline='') as output:
+            for _, line in heapq.merge(*[read_run(run) for run in paths], key=lambda item: item[0]):
+                output.write(line)
+
+    return save_file(write, chemin)
+
+def stream_export(zip_filename, files, courbe, aliment, conso_lait, visites, start_date="2000-01-01",
+                  end_date="3000-01-01", ipg="", weeks=None, interpolation=False, engine=None,
+                  chunksize=STREAM_CHUNKSIZE, on_step=None, on_chunk=None, report=None):
+    """
+    Compute the outputs of an export reading the consumption file (nr_03) block by block,
+    so the memory used depends on the size of the blocks and not on the size of the export.
+    DB_PAO and SICPA are written block by block as sorted runs, merged at the end. The daily
+    data is made from the day totals of the blocks, without reading the passages again.
+    The files are the same as with Pipeline.
+    Args:
+    - zip_filename: Path to the zip file, or a DalExport.
+    - files: Dictionary of the output paths by output name (keys of Pipeline.OUTPUTS).
+    - courbe, aliment, conso_lait, visites, start_date, end_date, ipg, weeks, interpolation, engine:
+      Settings of the outputs, see Pipeline.
+    - chunksize: Number of rows of the consumption file read at once.
+    - on_step: Function called with the name of each step (see STREAM_STEPS) before it is computed,
+      'write' being the merge of the runs of DB_PAO and SICPA.
+    - on_chunk: Function called after each block of the consumption file with the number of
+      consumptions read so far, e.g. to report the progress or to cancel the run by raising.
+    - report: RunReport measuring each step, None for no measures.
+    Returns:
+    - List of the written file paths, in the order of files (None for a file that could not be written).
+    """
+    with open_export(zip_filename) as export:
+        engine = open_engine(engine)
+        weeks = len(conso_lait[0]) if weeks is None and conso_lait else weeks
+        notify = on_step or (lambda step: None)
+        progress = on_chunk or (lambda consumptions: None)
+        stage = measured(report)
+        daily_outputs = [name for name in files if name not in PASSAGE_OUTPUTS]
+        written = {}
+
+        notify('cows')
+        with stage('cows') as record:
+            cows_id = animal_caract(export, start_date, end_date)
+            record['rows_out'] = len(cows_id)
+        animals = cows_id['URBAN_ID']
+
+        # The runs are written next to the first output, they are as large as the outputs
+        folder = os.path.dirname(os.path.abspath(next(iter(files.values()))))
+        with tempfile.TemporaryDirectory(dir=folder) as runs_folder:
+            runs = {name: [] for name in files if name in PASSAGE_OUTPUTS}
+            columns = {}
+            days, milk = [], []
+
+            notify('passages')
+            with stage('passages', len(cows_id)) as record:
+                rows, consumptions = 0, 0
+                for index, drinks in enumerate(iter_animal_data(export, animals, chunksize)):
+                    passages = build_passages(cows_id, drinks, courbe, aliment, engine)
+                    rows += len(passages)
+
+                    # Write the sorted block of each passage output
+                    for name in runs:
+                        frame = PASSAGE_OUTPUTS[name](passages, ipg)
+                        columns[name] = list(frame.columns)
+                        path = os.path.join(runs_folder, f'{name}_{index}.csv')
+                        write_run(frame, passages, path)
+                        runs[name].append(path)
+
+                    # Keep only the totals of the days and of the visits of the block
+                    if daily_outputs:
+                        days.append(aggregate_days(passages, engine))
+                        milk.append(visit_milk(drinks, engine))
+
+                    consumptions += len(drinks)
+                    progress(consumptions)
+                record['rows_out'] = rows
+
+            if runs:
+                notify('write')
+            with stage('merge', rows * len(runs)) as record:
+                for name, paths in runs.items():
+                    written[name] = merge_runs(paths, columns[name], files[name])
+                record['rows_out'] = rows * len(runs)
+
+        if daily_outputs:
+            notify('visits')
+            with stage('visits', len(cows_id)) as record:
+                milk = visit_milk(pd.concat(milk, ignore_index=True), engine)
+                all = visit_facts(export, start_date, animals, engine, milk)
+                record['rows_out'] = len(all)
+
+            notify('daily')
+            with stage('daily', sum(len(part) for part in days) + len(all)) as record:
+                daily = par_jour(merge_days(days, engine), all, courbe, conso_lait, visites, interpolation, engine)
+                frames = {'statistiques': statistiques(daily)}
+                record['rows_out'] = len(daily)
+            if 'semaines_completes' in files:
+                notify('complete_weeks')
+                with stage('complete_weeks', len(daily)) as record:
+                    frames['semaines_completes'] = sem_comp_jour(daily, weeks)
+                    record['rows_out'] = len(frames['semaines_completes'])
+
+            paths = save_measured([(frames[name], files[name]) for name in daily_outputs], report)
+            written.update(zip(daily_outputs, paths))
+
+        return [written[name] for name in files]
@@ -0,0 +1,226 @@
+import io
+import zipfile
+import numpy as np
+import pandas as pd
+from utils import SCHEMAS, format_dates, format_times
+
+# Columns of the members as the DAL writes them, the split layout adds '_datum'/'_zeit'
+# columns after each timestamp
+ANIMAL_COLUMNS = ['tiere_id', 'responder_nr', 'kurvennr', 'herdbuch_nr', 'tier_nr', 'inst_responder_nr', 'geburtsdatum']
+VISIT_COLUMNS = ['stationsbesuch_id', 'tiere_id', 'erste_erkennung', 'letzte_erkennung', 'noch_in_der_station',
+                 'gebaeude', 'terminal', 'automat', 'station', 'box', 'aktuelle_funktion']
+DRINK_COLUMNS = ['verbrauch_milch_id', 'stationsbesuch_id', 'tiere_id', 'sollmenge_milch', 'verbrauch_milch',
+                 'verbrauch_mat1', 'verbrauch_mat2', 'verbrauch_wasser', 'verbrauch_vollmilch',
+                 'zeit_fuetterung_start', 'zeit_fuetterung_fertig']
+
+# Milk allowances of a visit (L) and share of powder in the milk, as in the sample export
+ALLOWANCES = [1.333, 1.5, 2.0, 2.5]
+POWDER_SHARE = 0.113803
+
+# Number of cows generated at once, the memory used does not depend on the herd size
+BLOCK_COWS = 500
+
+# Curves of the synthetic exports and the farm prefix of their SICPA numbers, shared by the
+# benchmark and the regression tests
+CURVES = [1, 2]
+IPG = "FR000000"
+
+def curve_settings(days):
+    """
+    Theoretical tables of the synthetic curves, with a week for every age of the trial.
+    Args:
+    - days: Number of days of the trial.
+    Returns:
+    - (courbe, aliment, conso_lait, visites, weeks) as given to Pipeline.
+    """
+    weeks = days // 7 + 2
+    conso_lait = [[min(4 + week, 8) * (1 + index / 10) for week in range(weeks)] for index in range(len(CURVES))]
+    visites = [[5] * weeks for _ in CURVES]
+    return CURVES, [f"Aliment {curve}" for curve in CURVES], conso_lait, visites, weeks
+
+def animals_table(cows, curves, start_date, birth_spread, rng):
+    """
+    Generate the animal list (nr_00) of a herd.
+    Args:
+    - cows: Number of cows.
+    - curves: List of curve numbers, each cow gets one at random.
+    - start_date: First birth date.
+    - birth_spread: Number of days between the first and the last births.
+    - rng: numpy random Generator.
+    Returns:
+    - DataFrame with the columns of nr_00 and the birth dates as datetime in 'naissance'.
+    """
+    births = pd.Timestamp(start_date) + pd.to_timedelta(np.sort(rng.integers(0, birth_spread + 1, cows)), unit='D')
+    animals = pd.DataFrame({
+        'tiere_id': np.arange(1, cows + 1),
+        'responder_nr': 3714830000 + np.arange(1, cows + 1),
+        'kurvennr': rng.choice(curves, cows),
+        'herdbuch_nr': '',
+        'tier_nr': 1000 + np.arange(1, cows + 1),
+        'inst_responder_nr': '',
+        'naissance': births
+    })
+    animals['geburtsdatum'] = format_dates(animals['naissance'], '%d/%m/%Y')
+    return animals
+
+def visits_block(animals, days, visits_per_day, refusal_rate, rng):
+    """
+    Generate the station visits and the consumptions of some cows.
+    Each cow comes to the station from 1 to 3 days after its birth, for days days. The number
+    of visits of a day follows a Poisson law, a visit is refused (no consumption) with
+    probability refusal_rate.
+    Args:
+    - animals: Rows of animals_table for the cows of the block.
+    - days: Number of days of the trial.
+    - visits_per_day: Mean number of visits per cow and day.
+    - refusal_rate: Share of the visits without consumption.
+    - rng: numpy random Generator.
+    Returns:
+    - Tuple of (visits, drinks) DataFrames sorted by time, timestamps as datetime and without ids.
+    """
+    cows = len(animals)
+    counts = rng.poisson(visits_per_day, cows * days)
+    cow = np.repeat(np.repeat(np.arange(cows), days), counts)
+    day = np.repeat(np.tile(np.arange(days), cows), counts)
+    entry = rng.integers(1, 4, cows)
+
+    # Visits at random times of each day of the trial
+    births = animals['naissance'].to_numpy(dtype='datetime64[us]')
+    first = (births[cow] + (entry[cow] + day).astype('timedelta64[D]')
+             + rng.integers(0, 86400 * 10**6, len(cow)).astype('timedelta64[us]'))
+    order = np.argsort(first, kind='stable')
+    cow, first = cow[order], first[order]
+    drank = rng.random(len(cow)) >= refusal_rate
+
+    # A consumption starts just after the detection, the calf leaves some time after
+    start = first[drank] + rng.integers(10000, 50000, drank.sum()).astype('timedelta64[us]')
+    duration = np.clip(rng.lognormal(np.log(200), 0.6, drank.sum()), 5, 2400)
+    end = start + (duration * 10**6).astype('timedelta64[us]')
+    last = first + rng.integers(2, 60, len(cow)).astype('timedelta64[s]')
+    last[drank] = end + rng.integers(0, 120 * 10**6, drank.sum()).astype('timedelta64[us]')
+
+    visits = pd.DataFrame({
+        'tiere_id': animals['tiere_id'].to_numpy()[cow],
+        'erste_erkennung': first,
+        'letzte_erkennung': last,
+        'noch_in_der_station': 'f',
+        'gebaeude': 0,
+        'terminal': 1,
+        'automat': 1,
+        'station': 1,
+        'box': rng.integers(1, 3, len(cow)),
+        'aktuelle_funktion': 1
+    })
+    allowance = rng.choice(ALLOWANCES, drank.sum())
+    milk = np.round(allowance * rng.uniform(0.05, 1, drank.sum()), 6)
+    powder = np.round(milk * POWDER_SHARE, 6)
+    drinks = pd.DataFrame({
+        'visit': np.flatnonzero(drank),
+        'tiere_id': visits['tiere_id'].to_numpy()[drank],
+        'sollmenge_milch': allowance,
+        'verbrauch_milch': milk,
+        'verbrauch_mat1': powder,
+        'verbrauch_mat2': 0,
+        'verbrauch_wasser': np.round(milk - powder, 6),
+        'verbrauch_vollmilch': 0,
+        'zeit_fuetterung_start': start,
+        'zeit_fuetterung_fertig': end
+    })
+    return visits, drinks
+
+def format_timestamps(df, columns, layout):
+    """
+    Format the timestamp columns as the DAL writes them.
+    Args:
+    - df: DataFrame with datetime columns.
+    - columns: Names of the timestamp columns.
+    - layout: 'combined' for one timestamp column, 'split' to add the '_datum' and '_zeit' columns.
+    Returns:
+    - DataFrame with the columns formatted, in their order in the export.
+    """
+    df = df.copy()
+    names = []
+    for column in df.columns:
+        names.append(column)
+        if column not in columns:
+            continue
+        values = df[column]
+        df[column] = np.char.replace(np.datetime_as_string(values.to_numpy(dtype='datetime64[us]'), unit='us'), 'T', ' ')
+        if layout == 'split':
+            # The split columns are rounded to the second
+            rounded = values.dt.round('s')
+            df[f'{column}_datum'] = format_dates(rounded.dt.normalize(), '%d/%m/%Y')
+            df[f'{column}_zeit'] = format_times(rounded)
+            names += [f'{column}_datum', f'{column}_zeit']
+    return df[names]
+
+def write_member(zipf, member, blocks):
+    """
+    Write a member of the export block by block.
+    Args:
+    - zipf: The zipfile.ZipFile open for writing.
+    - member: Short name of the member ('animals', 'visits' or 'drinks').
+    - blocks: Iterator of DataFrames with the columns of the member.
+    Returns:
+    - Number of rows written.
+    """
+    rows = 0
+    with zipf.open(SCHEMAS[member]['filename'], 'w', force_zip64=True) as raw:
+        with io.TextIOWrapper(raw, encoding='utf-8', newline='') as file:
+            for index, block in enumerate(blocks):
+                block.to_csv(file, sep=';', index=False, header=index == 0, lineterminator='\n')
+                rows += len(block)
+    return rows
+
+def synthetic_export(zip_filename, cows=100, days=60, visits_per_day=8, refusal_rate=0.4, layout='combined',
+                     curves=(1,), start_date='2022-01-01', birth_spread=60, seed=0):
+    """
+    Write a synthetic DAL export with realistic visits and consumptions, to measure the
+    pipeline on herds of any size. The same arguments always give the same export.
+    Args:
+    - zip_filename: Path of the ZIP file to write.
+    - cows: Number of cows of the herd.
+    - days: Number of days each cow comes to the station.
+    - visits_per_day: Mean number of visits per cow and day.
+    - refusal_rate: Share of the visits without consumption.
+    - layout: 'combined' (timestamps in one column) or 'split' ('_datum'/'_zeit' columns).
+    - curves: List of curve numbers given to the cows.
+    - start_date: First birth date (YYYY-MM-DD).
+    - birth_spread: Number of days between the first and the last births.
+    - seed: Seed of the random generator.
+    Returns:
+    - Dictionary of the number of rows of each member ('animals', 'visits', 'drinks').
+    """
+    if layout not in ('combined', 'split'):
+        raise ValueError(f"Unknown layout: {layout}")
+    animals = animals_table(cows, list(curves), start_date, birth_spread, np.random.default_rng([seed, 0]))
+    starts = range(0, cows, BLOCK_COWS)
+
+    def blocks():
+        # Each block of cows has its own generator, so it is the same for both members
+        for index, first in enumerate(starts):
+            rng = np.random.default_rng([seed, 1, index])
+            yield visits_block(animals.iloc[first:first + BLOCK_COWS], days, visits_per_day, refusal_rate, rng)
+
+    def visit_blocks():
+        visit_id = 0
+        for visits, _ in blocks():
+            visits.insert(0, 'stationsbesuch_id', np.arange(visit_id + 1, visit_id + len(visits) + 1))
+            visit_id += len(visits)
+            yield format_timestamps(visits[VISIT_COLUMNS], ['erste_erkennung', 'letzte_erkennung'], layout)
+
+    def drink_blocks():
+        visit_id, drink_id = 0, 0
+        for visits, drinks in blocks():
+            drinks.insert(0, 'verbrauch_milch_id', np.arange(drink_id + 1, drink_id + len(drinks) + 1))
+            drinks.insert(1, 'stationsbesuch_id', visit_id + 1 + drinks.pop('visit'))
+            visit_id += len(visits)
+            drink_id += len(drinks)
+            yield format_timestamps(drinks[DRINK_COLUMNS], ['zeit_fuetterung_start', 'zeit_fuetterung_fertig'], layout)
+
+    with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        return {
+            'animals': write_member(zipf, 'animals', [animals[ANIMAL_COLUMNS]]),
+            'visits': write_member(zipf, 'visits', visit_blocks()),
+            'drinks': write_member(zipf, 'drinks', drink_blocks())
+        }
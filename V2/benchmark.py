@@ -0,0 +1,214 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+from datetime import datetime
+from Pipeline import OUTPUTS, Pipeline
+from Report import RunReport, save_measured
+from Synthetic import CURVES, IPG, curve_settings, synthetic_export
+from utils import SCHEMAS, DalExport
+
+# Herd sizes of the benchmark: name -> arguments of synthetic_export
+SIZES = {
+    'small': {'cows': 50, 'days': 60},
+    'medium': {'cows': 500, 'days': 60},
+    'large': {'cows': 2000, 'days': 90},
+    'huge': {'cows': 10000, 'days': 90}
+}
+
+# Differences too small to be regressions, whatever the threshold (timer and memory sampling noise)
+NOISE = {'seconds': 0.02, 'peak_mb': 5}
+
+# Measure of the memory peaks of the results, the peaks of older results (tracemalloc) are not compared
+MEMORY = 'rss'
+
+def commit_id():
+    """
+    Get the git commit of the measured code.
+    Returns:
+    - Short hash of the commit, with '-dirty' for uncommitted changes, None outside a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def export_path(folder, cows, days, layout):
+    """
+    Get the synthetic export of a size, writing it on first use.
+    Args:
+    - folder: Folder of the synthetic exports.
+    - cows, days: Size of the herd and of the trial.
+    - layout: Layout of the export, 'combined' or 'split'.
+    Returns:
+    - Path to the ZIP file.
+    """
+    path = os.path.join(folder, f"synthetic_{cows}x{days}_{layout}.zip")
+    if not os.path.exists(path):
+        os.makedirs(folder, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        synthetic_export(temporary, cows=cows, days=days, layout=layout, curves=CURVES)
+        os.replace(temporary, path)
+    return path
+
+def run_stages(zip_filename, days, engine, outputs):
+    """
+    Run the pipeline on an export one step at a time, then write the outputs, each step
+    measured as a stage of a RunReport.
+    Args:
+    - zip_filename: Path to the zip file.
+    - days: Number of days of the trial of the export.
+    - engine: Engine of the pipeline, 'pandas' or 'arrow'.
+    - outputs: List of output names (keys of OUTPUTS).
+    Returns:
+    - List of {'stage', 'seconds', 'peak_mb', 'rows'} dictionaries, in the order of the stages.
+      The memory peak is the resident memory of the process (None if it cannot be read).
+    """
+    courbe, aliment, conso_lait, visites, weeks = curve_settings(days)
+    pipeline = Pipeline(DalExport(zip_filename, cache=False), courbe, aliment, conso_lait, visites,
+                        ipg=IPG, weeks=weeks, engine=engine)
+    report = RunReport(zip_filename)
+
+    with report:
+        # The steps are planned after their dependencies, so each get computes one step
+        for step in pipeline.plan(outputs):
+            with report.stage(step) as record:
+                record['rows_out'] = len(pipeline.get(step))
+
+        with tempfile.TemporaryDirectory() as folder:
+            files = [(pipeline.get(OUTPUTS[name][0]), os.path.join(folder, OUTPUTS[name][1])) for name in outputs]
+            # The messages of the saved files are not shown
+            with contextlib.redirect_stdout(io.StringIO()):
+                save_measured(files, report)
+
+    return [{'stage': record['stage'], 'seconds': record['wall_s'], 'peak_mb': record['peak_mb'],
+             'rows': record['rows_out']} for record in report.stages]
+
+def benchmark(size, layout, engine, repeat, folder, outputs):
+    """
+    Measure each stage of the pipeline on a synthetic export.
+    The time of a stage is the best of repeat runs, its memory peak the highest of these runs.
+    Args:
+    - size: Name of the size (key of SIZES).
+    - layout: Layout of the export, 'combined' or 'split'.
+    - engine: Engine of the pipeline, 'pandas' or 'arrow'.
+    - repeat: Number of timed runs.
+    - folder: Folder of the synthetic exports.
+    - outputs: List of output names (keys of OUTPUTS).
+    Returns:
+    - List of the result records, one per stage.
+    """
+    cows, days = SIZES[size]['cows'], SIZES[size]['days']
+    zip_filename = export_path(folder, cows, days, layout)
+    with zipfile.ZipFile(zip_filename) as zipf:
+        with zipf.open(SCHEMAS['drinks']['filename']) as file:
+            passages = sum(1 for _ in file) - 1
+
+    runs = [run_stages(zip_filename, days, engine, outputs) for _ in range(max(repeat, 1))]
+
+    commit, date = commit_id(), datetime.now().isoformat(timespec='seconds')
+    records = []
+    for index, stage in enumerate(runs[0]):
+        peaks = [run[index]['peak_mb'] for run in runs if run[index]['peak_mb'] is not None]
+        records.append({
+            'commit': commit, 'date': date, 'size': size, 'cows': cows, 'days': days, 'passages': passages,
+            'layout': layout, 'engine': engine, 'stage': stage['stage'],
+            'seconds': round(min(run[index]['seconds'] for run in runs), 4),
+            'peak_mb': round(max(peaks), 1) if peaks else None, 'memory': MEMORY, 'rows': stage['rows']
+        })
+    return records
+
+def load_results(path):
+    """
+    Load the results of the previous benchmarks.
+    Args:
+    - path: Path of the JSON Lines file of the results.
+    Returns:
+    - List of the records, in the order they were measured (empty if the file does not exist).
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def format_peak(peak):
+    """Format a memory peak of the results, which can be missing."""
+    return f"{peak:9.1f}" if peak is not None else f"{'-':>9}"
+
+def compare(records, threshold=0.1):
+    """
+    Compare the last two commits measured, stage by stage.
+    Args:
+    - records: List of the result records.
+    - threshold: Relative slowdown (or memory increase) above which a stage is a regression.
+    Returns:
+    - (lines of the comparison table, number of regressions)
+    """
+    commits = list(dict.fromkeys(record['commit'] for record in reversed(records)))
+    if len(commits) < 2:
+        return ["Less than two commits measured, nothing to compare"], 0
+    new, old = commits[:2]
+
+    # The last measure of each stage of each commit is kept
+    key = lambda record: (record['size'], record['layout'], record['engine'], record['stage'])
+    before = {key(record): record for record in records if record['commit'] == old}
+    after = {key(record): record for record in records if record['commit'] == new}
+
+    lines = [f"{old} -> {new}", f"{'size':8} {'layout':9} {'engine':7} {'stage':15} {'seconds':>17} {'peak MB':>19}"]
+    regressions = 0
+    for stage in after:
+        if stage not in before:
+            continue
+        a, b = before[stage], after[stage]
+        slower = b['seconds'] > a['seconds'] * (1 + threshold) and b['seconds'] - a['seconds'] > NOISE['seconds']
+        larger = (a.get('memory') == b.get('memory') and a['peak_mb'] is not None and b['peak_mb'] is not None
+                  and b['peak_mb'] > a['peak_mb'] * (1 + threshold) and b['peak_mb'] - a['peak_mb'] > NOISE['peak_mb'])
+        regressions += slower or larger
+        lines.append(f"{stage[0]:8} {stage[1]:9} {stage[2]:7} {stage[3]:15} "
+                     f"{a['seconds']:8.3f}>{b['seconds']:8.3f}{'!' if slower else ' '} "
+                     f"{format_peak(a['peak_mb'])}>{format_peak(b['peak_mb'])}{'!' if larger else ' '}")
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time and memory-profile each stage of the V2 pipeline on synthetic exports.")
+    parser.add_argument('--sizes', default='small,medium', help="Comma-separated sizes among " + ", ".join(SIZES))
+    parser.add_argument('--layouts', default='combined', help="Comma-separated layouts among combined, split")
+    parser.add_argument('--engines', default='pandas', help="Comma-separated engines among pandas, arrow")
+    parser.add_argument('--outputs', default=','.join(OUTPUTS), help="Comma-separated outputs among " + ", ".join(OUTPUTS))
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed runs, the best one is kept")
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'dal_benchmark'),
+                        help="Folder of the synthetic exports, kept between runs")
+    parser.add_argument('-o', '--results', default='benchmarks.jsonl', help="JSON Lines file the results are appended to")
+    parser.add_argument('--compare', action='store_true', help="Only compare the last two commits of the results")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative increase reported as a regression")
+    args = parser.parse_args(argv)
+
+    sizes, outputs = args.sizes.split(','), args.outputs.split(',')
+    unknown = [size for size in sizes if size not in SIZES] + [name for name in outputs if name not in OUTPUTS]
+    if unknown:
+        parser.error(f"Unknown sizes or outputs: {', '.join(unknown)}")
+
+    if not args.compare:
+        for size in sizes:
+            for layout in args.layouts.split(','):
+                for engine in args.engines.split(','):
+                    records = benchmark(size, layout, engine, args.repeat, args.data, outputs)
+                    with open(args.results, 'a', encoding='utf-8') as file:
+                        file.writelines(json.dumps(record) + '\n' for record in records)
+                    for record in records:
+                        print(f"{size:8} {layout:9} {engine:7} {record['stage']:15} "
+                              f"{record['seconds']:8.3f} s {format_peak(record['peak_mb'])} MB {record['rows']:>10} rows")
+
+    lines, regressions = compare(load_results(args.results), args.threshold)
+    print("\n".join(lines))
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
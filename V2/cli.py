@@ -0,0 +1,103 @@
+import argparse
+import json
+import sys
+from Batch import EXPORT_ERRORS, find_exports, process_export, run_batch
+from Pipeline import OUTPUTS
+
+# TOML configuration files need tomllib (Python 3.11) or tomli
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+def load_config(path):
+    """
+    Load the configuration file of a run.
+    Args:
+    - path: Path to a .json or .toml file.
+    Returns:
+    - Dictionary of the configuration.
+    """
+    if path.lower().endswith('.toml'):
+        if tomllib is None:
+            raise ValueError("Reading TOML files needs Python 3.11 or the tomli package")
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Process DAL ZIP exports without the graphical interface.")
+    parser.add_argument('zips', nargs='+', help="ZIP export(s) of the DAL, or folders of exports")
+    parser.add_argument('-c', '--config', required=True,
+                        help="JSON or TOML file with the curves, aliments and theoretical values")
+    parser.add_argument('--start', help="First birth date of the cows (YYYY-MM-DD)")
+    parser.add_argument('--end', help="Last birth date of the cows (YYYY-MM-DD)")
+    parser.add_argument('-o', '--output', help="Output folder (a subfolder per station with several ZIPs)")
+    parser.add_argument('--outputs', help="Comma-separated outputs among " + ", ".join(OUTPUTS))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="Number of exports processed in parallel (number of processors by default)")
+    parser.add_argument('--combined', action='store_true',
+                        help="Also write herd-wide files concatenating all the stations")
+    parser.add_argument('--stream', action='store_true',
+                        help="Read the consumption file block by block, for exports larger than the memory")
+    parser.add_argument('--chunksize', type=int, help="Number of consumption rows per block with --stream")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only read the rows newer than the previous export of the same station")
+    parser.add_argument('--state-dir', help="Folder of the incremental states (DAL_STATE_DIR or ~/.dal_state by default)")
+    parser.add_argument('--cache-dir',
+                        help="Folder caching the parsed tables of the exports (DAL_CACHE_DIR, no cache by default)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Also save a cProfile of each run (run_profile.prof) next to its report")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config)
+    except EXPORT_ERRORS as e:
+        parser.error(f"Cannot read the configuration: {str(e)}")
+
+    # The command line overrides the configuration file
+    config['start_date'] = args.start or config.get('start_date')
+    config['end_date'] = args.end or config.get('end_date')
+    if not config['start_date'] or not config['end_date']:
+        parser.error("The birth date window is needed (--start/--end or start_date/end_date)")
+    config['stream'] = args.stream or config.get('stream', False)
+    if args.chunksize:
+        config['chunksize'] = args.chunksize
+    config['profile'] = args.profile or config.get('profile', False)
+    config['incremental'] = args.incremental or config.get('incremental', False)
+    if args.state_dir:
+        config['state_dir'] = args.state_dir
+    if args.cache_dir:
+        config['cache_dir'] = args.cache_dir
+    output_dir = args.output or config.get('output_dir', '.')
+    outputs = args.outputs.split(',') if args.outputs else config.get('outputs', list(OUTPUTS))
+    unknown = [name for name in outputs if name not in OUTPUTS]
+    if unknown:
+        parser.error(f"Unknown outputs: {', '.join(unknown)}")
+
+    zip_filenames = find_exports(args.zips)
+    if not zip_filenames:
+        parser.error("No ZIP export found")
+
+    # A single export is written directly in the output folder
+    if len(zip_filenames) == 1 and not args.combined:
+        try:
+            process_export(zip_filenames[0], config, output_dir, outputs)
+        except EXPORT_ERRORS as e:
+            print(f"Error processing {zip_filenames[0]}: {str(e)}", file=sys.stderr)
+            return 1
+        return 0
+
+    # Each station gets its own folder when several exports are processed
+    errors = run_batch(zip_filenames, config, output_dir, outputs, args.jobs, args.combined)
+    for zip_filename, error in errors.items():
+        print(f"Error processing {zip_filename}: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
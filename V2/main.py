@@ -2,12 +2,15 @@ import tkinter as tk
 from tkinter import ttk, filedialog, Label, Button, Toplevel, Message, Frame, StringVar, OptionMenu, Entry, Text
 import json
 import os
+import queue
 import sys
+import threading
 import zipfile
 from datetime import datetime 
-from utils import curve,save_dataframe
-from Data import par_jour,par_passage
-from Output import sicpa,sem_comp_jour
+from utils import curve,DalExport
+from Pipeline import Pipeline,OUTPUTS
+from Stream import STREAM_STEPS,needs_streaming,stream_export
+from Report import RunReport,save_measured
 
 class InfoWindow:
     """Class to manage information windows."""
@@ -34,8 +37,188 @@ class InfoWindow:
             self.info_window.destroy()
             self.info_window = None
 
+class Cancelled(Exception):
+    """Raised in a background task when the user cancels it."""
+
+class BackgroundTask:
+    """Class to run a long processing outside of the Tk main loop.
+
+    The function runs in a worker thread and reports its stages with `stage`.
+    Progress, result and errors are sent back to the Tk thread through a queue,
+    the only safe way to update the widgets or to call `MainApp.error`.
+    """
+    def __init__(self, root, function, on_progress, on_done, on_error, on_cancel):
+        self.root = root
+        self.function = function
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.finished = False
+
+    def start(self):
+        """Start the worker thread and the polling of its messages."""
+        threading.Thread(target=self.run, daemon=True).start()
+        self.root.after(100, self.poll)
+
+    def cancel(self):
+        """Ask the worker to stop before its next stage."""
+        self.cancel_event.set()
+
+    def stage(self, name, fraction):
+        """Report the start of a stage from the worker thread.
+
+        Args:
+            name (str): Name of the stage (text 'progress_<name>').
+            fraction (float): Progress of the processing between 0 and 1.
+        """
+        if self.cancel_event.is_set():
+            raise Cancelled()
+        self.queue.put(('progress', name, fraction))
+
+    def run(self):
+        """Run the function in the worker thread and send its outcome."""
+        try:
+            self.queue.put(('done', self.function(self)))
+        except Cancelled:
+            self.queue.put(('cancelled', None))
+        except Exception as e:
+            self.queue.put(('error', e))
+
+    def poll(self):
+        """Handle the messages of the worker in the Tk thread."""
+        try:
+            while True:
+                message = self.queue.get_nowait()
+                if message[0] == 'progress':
+                    self.on_progress(message[1], message[2])
+                    continue
+                self.finished = True
+                if message[0] == 'done':
+                    self.on_done(message[1])
+                elif message[0] == 'cancelled':
+                    self.on_cancel()
+                else:
+                    self.on_error(message[1])
+                return
+        except queue.Empty:
+            self.root.after(100, self.poll)
+
+class CurveTable:
+    """Table of the theoretical values of one curve, in a tab of the notebook.
+
+    The values live in a plain model, a dictionary with the aliment and one list of
+    strings per column, so they are read without looking for the widgets. The Entry
+    widgets are bound to the model and reused: changing the number of weeks only adds
+    the missing rows or hides the extra ones, and the values typed stay in their cells.
+
+    Args:
+        notebook (ttk.Notebook): Notebook of the curves.
+        title (str): Title of the tab (number of the curve).
+        colonnes (list): Titles of the week, liter and passage columns.
+        week_label (str): Text before the number of each week.
+        model (dict): Model of the curve, from new_model, kept by the caller.
+        on_focus_in (callable): Handler of the focus in a value cell.
+        on_focus_out (callable): Handler of the focus out of a value cell.
+    """
+    # Lists of the model, in the order of the value columns
+    COLUMNS = ['conso_lait', 'visites']
+
+    def __init__(self, notebook, title, colonnes, week_label, model, on_focus_in, on_focus_out):
+        self.frame = Frame(notebook)
+        notebook.add(self.frame, text=title)
+        self.model = model
+        self.week_label = week_label
+        self.on_focus_in = on_focus_in
+        self.on_focus_out = on_focus_out
+        self.rows = []
+        self.weeks = 0
+
+        # The Tk variables are kept, they are deleted with their Python object
+        self.aliment = StringVar(self.frame, value=model['aliment'])
+        self.aliment.trace_add("write", lambda *args: model.update(aliment=self.aliment.get()))
+        self.variables = []
+
+        aliment_entry = Entry(self.frame, textvariable=self.aliment)
+        aliment_entry.grid(row=0, column=0, columnspan=len(colonnes), pady=5)
+
+        for col in range(len(colonnes)):
+            label = Label(self.frame, text=colonnes[col], borderwidth=1, relief='solid', bg='lightgrey')
+            label.grid(row=1, column=col, sticky='nsew')
+            self.frame.columnconfigure(col, weight=1)
+
+    @staticmethod
+    def new_model():
+        """Return the model of a curve without values."""
+        return {'aliment': '', 'conso_lait': [], 'visites': []}
+
+    def store(self, column, week, variable):
+        """Copy a cell typed in the table to the model."""
+        self.model[column][week] = variable.get()
+
+    def add_row(self):
+        """Create the widgets of the next week, bound to its cells of the model."""
+        week = len(self.rows)
+        week_entry = Entry(self.frame, borderwidth=1, relief='solid', justify='center')
+        week_entry.insert(0, f'{self.week_label} {week + 1}')
+        week_entry.config(fg='black', state='readonly')
+        cells = [week_entry]
+
+        for column in self.COLUMNS:
+            values = self.model[column]
+            if len(values) <= week:
+                values.append('0')
+            variable = StringVar(self.frame, value=values[week])
+            variable.trace_add("write", lambda *args, c=column, v=variable: self.store(c, week, v))
+            self.variables.append(variable)
+
+            entry = Entry(self.frame, textvariable=variable, borderwidth=1, relief='solid', justify='center',
+                          fg='grey' if values[week] == '0' else 'black')
+            entry.bind("<FocusIn>", self.on_focus_in)
+            entry.bind("<FocusOut>", self.on_focus_out)
+            cells.append(entry)
+        self.rows.append(cells)
+
+    def resize(self, weeks):
+        """Show the rows of the first weeks, creating only the rows never shown.
+
+        Args:
+            weeks (int): Number of weeks of the table.
+        """
+        weeks = max(weeks, 0)
+        while len(self.rows) < weeks:
+            self.add_row()
+
+        # Only the rows between the old and the new number of weeks change
+        for week in range(min(self.weeks, weeks), max(self.weeks, weeks)):
+            for col, cell in enumerate(self.rows[week]):
+                if week < weeks:
+                    cell.grid(row=week + 2, column=col, sticky='nsew')
+                else:
+                    cell.grid_remove()
+        self.weeks = weeks
+
+    def read(self, weeks):
+        """Return the aliment and the values of the first weeks, from the model.
+
+        Args:
+            weeks (int): Number of weeks to read.
+
+        Returns:
+            tuple: (aliment, conso_lait, visites), the values as typed ('0' for a week never shown).
+        """
+        columns = [self.model[column][:weeks] + ['0'] * (weeks - len(self.model[column])) for column in self.COLUMNS]
+        return (self.model['aliment'], *columns)
+
 class MainApp:
     """Class to manage the main application."""
+
+    # Progress text shown for each step of the pipeline
+    STEP_STAGES = {'cows': 'read', 'drinks': 'read', 'visits': 'read', 'passages': 'passage', 'pao': 'passage',
+                   'daily': 'day', 'statistiques': 'day', 'sicpa': 'sicpa', 'complete_weeks': 'weeks', 'write': 'write'}
+
     def __init__(self, root, texts):
         # Initialize the main window settings
         self.root = root
@@ -50,19 +233,21 @@ class MainApp:
         # Initialize variables for language selection and input fields
         self.language_var = StringVar(value="en")
         self.entries = {}
-        self.table_entries = {}
-        self.aliment_entries = {}
         
         # Create language selector
         self.create_language_selector()
         
         # Initialize other attributes
         self.courbe = []
-        self.tabs = []
+        self.tables = []
+        self.models = {}
+        self.aliment_label = None
+        self.export = None
+        self.task = None
         self.weeks_var = StringVar(value="0")
 
         # Update tables when weeks_var changes, if courbe is set
-        self.weeks_var.trace_add("write", lambda *args: self.update_tables() if self.courbe else None)
+        self.weeks_var.trace_add("write", lambda *args: self.update_tables())
         
         # Set up header
         self.header()
@@ -114,22 +299,6 @@ class MainApp:
         self.entries['week'] = self.entry_week.get()
         self.entries['comp'] = self.entry_comp.get()
 
-        # Save table entries
-        for tab_index, tab in enumerate(self.tabs):
-            aliment_entry = tab.grid_slaves(row=0, column=0)
-            if aliment_entry:
-                self.aliment_entries[f'tab_{tab_index}'] = aliment_entry[0].get()
-
-            tab_entries = []
-            for row in range(2, int(self.weeks) + 2):
-                row_entries = []
-                for col in range(1, len(self.colonnes)):
-                    entry = tab.grid_slaves(row=row, column=col)
-                    if entry:
-                        row_entries.append(entry[0].get())
-                tab_entries.append(row_entries)
-            self.table_entries[f'tab_{tab_index}'] = tab_entries
-
     def restore_entries(self):
         """Restore the saved values of entry fields."""
         # Restore values in entry fields
@@ -146,25 +315,6 @@ class MainApp:
         self.entry_week.insert(0, self.entries.get('week', ''))
         self.entry_comp.insert(0, self.entries.get('comp', ''))
 
-        # Restore table entries
-        for tab_index, tab in enumerate(self.tabs):
-            if f'tab_{tab_index}' in self.aliment_entries:
-                aliment_entry = tab.grid_slaves(row=0, column=0)
-                if aliment_entry:
-                    aliment_entry[0].delete(0, tk.END)
-                    aliment_entry[0].insert(0, self.aliment_entries[f'tab_{tab_index}'])
-
-            if f'tab_{tab_index}' in self.table_entries:
-                for row_index, row_values in enumerate(self.table_entries[f'tab_{tab_index}']):
-                    for col_index, value in enumerate(row_values):
-                        entry = tab.grid_slaves(row=row_index + 2, column=col_index + 1)
-                        if entry:
-                            entry[0].delete(0, tk.END)
-                            entry[0].insert(0, value)
-                            # Set text color to black if restored value is not zero
-                            if value != '0':
-                                entry[0].config(fg='black')
-
     def text(self, x, y, color, text, font, info):
         # Create a frame with a background color and position it at (x, y)
         frame = Frame(self.root, bg=color)
@@ -188,8 +338,9 @@ class MainApp:
             cursor="hand2"  # Hand cursor on hover
         )
         info_button.pack(side=tk.LEFT)
+        return frame
 
-    def browse_file(self, x, y, path, width=40):
+    def browse_file(self, x, y, path, width=40, on_select=None):
         # Create a frame for file browsing components
         browse = Frame(self.root)
         browse.grid(row=1, column=3, columnspan=4, padx=0, sticky="nsw")
@@ -200,14 +351,14 @@ class MainApp:
 
         # Create a button to open file or folder dialog
         browse_button = Button(browse, text=self.texts['browse'], bg="#9FCDA8", activebackground="#FFA29A",
-                            command=lambda: self.browse_files(entry_filename, path))
+                            command=lambda: self.browse_files(entry_filename, path, on_select))
         browse_button.pack(side=tk.LEFT)
 
         # Position the browse frame at (x, y)
         browse.place(x=x, y=y)
         return entry_filename
 
-    def browse_files(self, entry_filename, path):
+    def browse_files(self, entry_filename, path, on_select=None):
         # Create a hidden top-level window for file or folder dialog
         selection_window = tk.Tk()
         selection_window.withdraw()
@@ -224,6 +375,10 @@ class MainApp:
         entry_filename.insert(tk.END, filename)
         selection_window.destroy()
 
+        # Let the caller start using the selected path
+        if filename and on_select is not None:
+            on_select(filename)
+
     def date_group_cow(self, x, y):
         # Create a frame for date entry fields
         date_cow = Frame(self.root, bg="#9FCDA8")
@@ -276,51 +431,27 @@ class MainApp:
         easter.transient(self.root)
         easter.wait_window(easter)
 
+    def build_tables(self):
+        """Create a table for each curve, with the values kept for the curve."""
+        for table in self.tables:
+            table.frame.destroy()
+        self.tables = [
+            CurveTable(self.notebook, cour, self.colonnes, self.texts["sem"],
+                       self.models.setdefault(cour, CurveTable.new_model()), self.on_entry_click, self.on_focus_out)
+            for cour in self.courbe
+        ]
+        if self.courbe and (self.aliment_label is None or not self.aliment_label.winfo_exists()):
+            self.aliment_label = self.text(180, 225, "white", self.texts["aliment_label"], ("Helvetica", 13, "bold"), self.texts["aliment_info"])
+        self.update_tables()
+
     def update_tables(self):
+        """Show the number of weeks typed in every table, keeping the values already typed."""
         try:
-            self.weeks = int(self.weeks_var.get())
-            for tab in self.tabs:
-                if tab.winfo_exists():
-                    for widget in tab.winfo_children():
-                        widget.destroy()
-            for tab in self.tabs:
-                tab.destroy()
-            
-            self.tabs.clear()
-
-            for cour in self.courbe:
-                tab = Frame(self.notebook)
-                self.notebook.add(tab, text=cour)
-                self.tabs.append(tab)
-
-                self.text(180, 225, "white", self.texts["aliment_label"], ("Helvetica", 13, "bold"), self.texts["aliment_info"])
-                aliment_entry = Entry(tab)
-                aliment_entry.grid(row=0, column=0, columnspan=len(self.colonnes), pady=5)
-
-                for col in range(len(self.colonnes)):
-                    label = Label(tab, text=self.colonnes[col], borderwidth=1, relief='solid', bg='lightgrey')
-                    label.grid(row=1, column=col, sticky='nsew')
-
-                for row in range(2, self.weeks + 2):
-                    for col in range(len(self.colonnes)):
-                        entry = Entry(tab, borderwidth=1, relief='solid', justify='center')
-                        entry.grid(row=row, column=col, sticky='nsew')
-
-                        if col == 0:
-                            entry.insert(0, f'{self.texts["sem"]} {row-1}')
-                            entry.config(fg='black', state='readonly')
-                        else:
-                            entry.insert(0, '0')
-                            entry.config(fg='grey')
-
-                        entry.bind("<FocusIn>", self.on_entry_click)
-                        entry.bind("<FocusOut>", self.on_focus_out)
-
-                for col in range(len(self.colonnes)):
-                    tab.columnconfigure(col, weight=1)
-
+            weeks = int(self.weeks_var.get())
         except ValueError:
-            pass
+            return
+        for table in self.tables:
+            table.resize(weeks)
 
     def on_entry_click(self, event):
         """Clear the text when the entry is clicked."""
@@ -336,6 +467,62 @@ class MainApp:
             entry.insert(0, '0')
             entry.config(fg='grey')  # Change text color to grey
 
+    def run_task(self, function, on_done):
+        """Run a processing in a background task, with progress bar and cancel button.
+
+        Args:
+            function (callable): Function run in the worker thread, it receives the task.
+            on_done (callable): Function called in the Tk thread with the result.
+        """
+        if self.task is not None and not self.task.finished:
+            return
+
+        def done(result):
+            self.end_task('progress_done')
+            on_done(result)
+
+        def failed(error):
+            self.end_task('')
+            self.error(f"{self.texts['task_error']}\n{error}")
+
+        self.task = BackgroundTask(self.root, function, self.show_progress, done, failed,
+                                   lambda: self.end_task('progress_cancelled'))
+        self.Extract.config(state=tk.DISABLED)
+        self.refresh_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.task.start()
+
+    def show_progress(self, stage, fraction):
+        """Show the current stage of the background task."""
+        self.progress_bar['value'] = fraction * 100
+        self.progress_label.config(text=self.texts[f'progress_{stage}'])
+
+    def end_task(self, text):
+        """Reset the controls at the end of the background task."""
+        self.progress_bar['value'] = 100 if text == 'progress_done' else 0
+        self.progress_label.config(text=self.texts[text] if text else '')
+        self.cancel_button.config(state=tk.DISABLED)
+        self.refresh_button.config(state=tk.NORMAL)
+        if self.courbe:
+            self.Extract.config(state=tk.NORMAL)
+
+    def cancel_task(self):
+        """Cancel the background task, it stops before its next stage."""
+        if self.task is not None:
+            self.task.cancel()
+
+    def get_export(self, zip_path):
+        """Return the export session of the ZIP file, reusing it while the file is unchanged.
+
+        Args:
+            zip_path (str): Path of the ZIP file.
+        """
+        if self.export is None or not self.export.is_current(zip_path):
+            if self.export is not None:
+                self.export.close()
+            self.export = DalExport(zip_path)
+        return self.export
+
     def refresh_curves(self):
         """Refresh the list of curves and update the tabs in the notebook.
         """
@@ -377,22 +564,54 @@ class MainApp:
             self.error(self.texts['date_order'])
             return
 
-        # Initialize curves with the provided ZIP file and date range
-        self.courbe = curve(zip_path, start_date, end_date)
+        # The birth dates were read in the background when the ZIP was chosen, the window is found at once
+        export = self.get_export(zip_path)
+        if export.indexed():
+            self.show_curves(curve(export, start_date, end_date))
+            return
+
+        # Otherwise find the curves in a background task with the provided ZIP file and date range
+        def work(task):
+            task.stage('read', 0)
+            return curve(export, start_date, end_date)
 
-        # Clear existing tabs
-        for tab in self.tabs:
-            tab.destroy()
-        self.tabs.clear()
+        self.run_task(work, self.show_curves)
 
-        # Create new tabs for each curve
-        for cour in self.courbe:
-            tab = Frame(self.notebook, bg='lightyellow')
-            self.notebook.add(tab, text=cour)
-            self.tabs.append(tab)
+    def prefetch_curves(self, zip_path):
+        """Read the animals of a ZIP file in the background, before the curves are refreshed.
 
-        # Update tables and enable extract button
-        self.update_tables()
+        Args:
+            zip_path (str): Path of the chosen ZIP file, ignored if it is not a ZIP file.
+        """
+        if not zip_path.lower().endswith('.zip') or not zipfile.is_zipfile(zip_path):
+            return
+
+        # A running task keeps its export session, it is not replaced
+        if self.task is not None and not self.task.finished:
+            return
+        export = self.get_export(zip_path)
+        if export.indexed():
+            return
+
+        def prefetch():
+            # The errors are shown when the curves are refreshed
+            try:
+                export.birth_index()
+            except Exception:
+                pass
+
+        threading.Thread(target=prefetch, daemon=True).start()
+
+    def show_curves(self, courbe):
+        """Create a tab for each curve found in the ZIP file.
+
+        Args:
+            courbe (list): Numbers of the curves.
+        """
+        self.courbe = courbe
+
+        # Replace the tables, a curve found again keeps its values, then enable extract button
+        self.build_tables()
         self.Extract.config(state=tk.NORMAL)
 
     def error(self, message):
@@ -486,30 +705,16 @@ class MainApp:
         conso_lait = []
         aliment_data = []
 
-        # Process each tab to extract data
-        for tab_index, tab in enumerate(self.tabs):
-            aliment_entry = tab.grid_slaves(row=0, column=0)
-            aliment_name = aliment_entry[0].get() if aliment_entry else ""
-
-            liter_column = []
-            passage_column = []
-
-            for row in range(2, int(num_weeks) + 2):
-                liter_entry = tab.grid_slaves(row=row, column=1)
-                passage_entry = tab.grid_slaves(row=row, column=2)
-
-                liter_value = liter_entry[0].get() if liter_entry else 0
-                passage_value = passage_entry[0].get() if passage_entry else 0
-                try:
-                    liter_value = float(liter_value)
-                    passage_value = float(passage_value)
-                except ValueError:
-                    self.error(self.texts['table_fill'])
-                    return
-
-                liter_column.append(liter_value)
-                passage_column.append(passage_value)
-            
+        # Read the values of each curve from the model of its table
+        for table in self.tables:
+            aliment_name, liters, passages = table.read(int(num_weeks))
+            try:
+                liter_column = [float(value) for value in liters]
+                passage_column = [float(value) for value in passages]
+            except ValueError:
+                self.error(self.texts['table_fill'])
+                return
+
             aliment_data.append(aliment_name)
             conso_lait.append(liter_column)
             visites.append(passage_column)
@@ -520,37 +725,77 @@ class MainApp:
         week_path = self.entry_week.get()
         comp_path = self.entry_comp.get()
 
-        # Parse and save data for PAO
-        data_pao, all_data = par_passage(zip_path, Courbe, aliment_data, start_date, end_date)
-        if checkbutton_states[0]:
-            if not os.path.isdir(pao_path):
-                self.error(self.texts['directory'])
-                return
-            save_dataframe(data_pao, os.path.join(pao_path, "DB_PAO.csv"))
-        
-        # Parse and save weekly data
-        data_week = par_jour(data_pao, all_data, Courbe, conso_lait, visites)
-        if checkbutton_states[2]:
-            if not os.path.isdir(pao_path):
-                self.error(self.texts['directory'])
-                return
-            save_dataframe(data_week, os.path.join(week_path, "Statistiques.csv"))
-        
-        # Parse and save SICPA data
-        data_sicpa = sicpa(data_pao, ipg_number)
-        if checkbutton_states[1]:
-            if not os.path.isdir(sicpa_path):
-                self.error(self.texts['directory'])
-                return
-            save_dataframe(data_sicpa, os.path.join(sicpa_path, "SICPA.csv"))
-        
-        # Parse and save complete weeks data
-        data_comp = sem_comp_jour(data_week, num_weeks)
-        if checkbutton_states[3]:
-            if not os.path.isdir(comp_path):
+        # Output files selected, with their directory
+        selected = [
+            (path, name) for checked, path, name in zip(
+                checkbutton_states, [pao_path, sicpa_path, week_path, comp_path], OUTPUTS)
+            if checked
+        ]
+        for path, _ in selected:
+            if not os.path.isdir(path):
                 self.error(self.texts['directory'])
                 return
-            save_dataframe(data_comp, os.path.join(comp_path, "Semaines_completes.csv"))
+
+        export = self.get_export(zip_path)
+        settings = (Courbe, aliment_data, conso_lait, visites, start_date, end_date, ipg_number, num_weeks)
+
+        def stream(task, report):
+            # Exports too large for the memory are read block by block and written directly
+            files = {name: os.path.join(path, OUTPUTS[name][1]) for path, name in selected}
+            fraction = lambda step: STREAM_STEPS.index(step) / len(STREAM_STEPS)
+            # Each block of consumptions reports the passage stage again, so Cancel stops the run between blocks
+            stream_export(export, files, *settings,
+                          on_step=lambda step: task.stage(self.STEP_STAGES[step], fraction(step)),
+                          on_chunk=lambda consumptions: task.stage('passage', fraction('passages')),
+                          report=report)
+
+        def work(task, report):
+            # Compute only the selected outputs and the steps they need
+            pipeline = Pipeline(export, *settings)
+            plan = pipeline.plan([name for _, name in selected])
+            data = pipeline.run([name for _, name in selected],
+                                lambda step: task.stage(self.STEP_STAGES[step], 0.8 * plan.index(step) / len(plan)),
+                                report)
+
+            # Save the selected files in parallel
+            task.stage('write', 0.8)
+            save_measured([(data[name], os.path.join(path, OUTPUTS[name][1])) for path, name in selected], report)
+
+        def measured(task):
+            # The report of the run is saved next to the first output file
+            with RunReport(zip_path) as report:
+                (stream if needs_streaming(export) else work)(task, report)
+            if selected:
+                report.save(selected[0][0])
+            return report
+
+        self.run_task(measured, self.show_report)
+
+    def show_report(self, report):
+        """Display the time, rows and memory of each stage of the extraction in a pop-up window.
+
+        Args:
+            report (RunReport): Report of the finished extraction.
+        """
+        report_window = Toplevel(self.root, bg="#9FCDA8")
+        report_window.title(self.texts['report_title'])
+        report_window.resizable(False, False)
+
+        # One row per stage, then the totals of the run
+        columns = ['stage', 'wall', 'cpu', 'rows_in', 'rows_out', 'peak']
+        table = ttk.Treeview(report_window, columns=columns, show='headings', height=len(report.stages) + 1)
+        for column in columns:
+            table.heading(column, text=self.texts[f'report_{column}'])
+            table.column(column, width=140 if column == 'stage' else 100, anchor='w' if column == 'stage' else 'e')
+        cell = lambda value: '' if value is None else value
+        for record in report.stages + [dict(report.total, stage=self.texts['report_total'])]:
+            table.insert('', tk.END, values=[record['stage'], record['wall_s'], record['cpu_s'], cell(record.get('rows_in')),
+                                             cell(record.get('rows_out')), cell(record['peak_mb'])])
+        table.pack(padx=10, pady=10)
+
+        # Add an 'OK' button to close the report window
+        close_button = Button(report_window, bg="#9FCDA8", text="OK", command=report_window.destroy)
+        close_button.pack(pady=5)
 
     def header(self):
         """Set up the main interface header and controls."""
@@ -563,8 +808,10 @@ class MainApp:
         self.text(880, 13, "#9FCDA8", "", ("Helvetica", 16, "bold"), self.texts["language_info"])
         self.text(120, 60, "#9FCDA8", self.texts["zip_file_label"], ("Helvetica", 16, "bold"), self.texts["zip_file_info"])
         
-        # Add entry for ZIP file path
-        self.entry_zip = self.browse_file(250, 65, "file")
+        # Add entry for ZIP file path, the curves are looked for as soon as a file is chosen
+        self.entry_zip = self.browse_file(250, 65, "file", on_select=self.prefetch_curves)
+        self.entry_zip.bind("<FocusOut>", lambda event: self.prefetch_curves(self.entry_zip.get()))
+        self.entry_zip.bind("<Return>", lambda event: self.prefetch_curves(self.entry_zip.get()))
         
         # Add date range input fields
         self.text(230, 100, "#9FCDA8", self.texts["cow_block_label"], ("Helvetica", 16, "bold"), self.texts["cow_block_info"])
@@ -588,13 +835,13 @@ class MainApp:
         
         # Add refresh button
         self.text(220, 145, "#9FCDA8", "", ("Helvetica", 16, "bold"), self.texts["refresh_info"])
-        refresh_button = Button(self.root, bg="#9FCDA8", activebackground="#FFA29A", text=self.texts["refresh"], command=self.refresh_curves)
-        refresh_button.place(x=240, y=145)
+        self.refresh_button = Button(self.root, bg="#9FCDA8", activebackground="#FFA29A", text=self.texts["refresh"], command=self.refresh_curves)
+        self.refresh_button.place(x=240, y=145)
         
         # Add notebook for displaying curves
         self.notebook = ttk.Notebook(self.root)
         self.notebook.place(x=100, y=200, width=600, height=360)
-        self.update_tables()
+        self.build_tables()
         self.text(75, 200, "#9FCDA8", "", ("Helvetica", 16, "bold"), self.texts["table_info"])
         
         # Add extract options and button
@@ -625,6 +872,14 @@ class MainApp:
         self.Extract = Button(text=self.texts["extract"], bg="#1B4B65", fg="white", activebackground="#81657C", font=("Helvetica", 16, "bold"), state=tk.DISABLED, command=self.extract)
         self.Extract.place(x=850, y=530)
 
+        # Add progress bar and cancel button of the background processing
+        self.progress_bar = ttk.Progressbar(self.root, mode='determinate', maximum=100)
+        self.progress_bar.place(x=100, y=568, width=480)
+        self.progress_label = Label(self.root, bg="#9FCDA8", text="")
+        self.progress_label.place(x=590, y=566)
+        self.cancel_button = Button(self.root, text=self.texts["cancel"], bg="#9FCDA8", activebackground="#FFA29A", state=tk.DISABLED, command=self.cancel_task)
+        self.cancel_button.place(x=760, y=536)
+
 
 def resource_path(relative_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -0,0 +1,249 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+from Batch import process_export, run_batch
+from Cache import ExportCache
+from Pipeline import OUTPUTS, Pipeline
+from Stream import stream_export
+from cli import main
+from Synthetic import CURVES, IPG, curve_settings, synthetic_export
+from utils import SCHEMAS, DalExport, save_dataframes
+
+# Size of the synthetic exports, small enough to run in a few seconds
+COWS = 30
+DAYS = 20
+LAYOUTS = ('combined', 'split')
+
+# Rows of the consumption file per block when streaming, not a divisor of the rows so the
+# blocks split the days of a cow. The streamed exports are read with the pandas parser, the
+# Arrow parser gives blocks of its own size (about 1 MB), larger than the whole test export
+CHUNKSIZE = 997
+
+# Exports named as the DAL does, so the incremental mode sees two exports of the same station
+PARTIAL_EXPORTS = ('2022_01_15__00_00_00_touch01__csv_export.zip', '2022_02_01__00_00_00_touch01__csv_export.zip')
+
+def batch_config(**options):
+    """Configuration of process_export with the synthetic curves."""
+    courbe, aliment, conso_lait, visites, weeks = curve_settings(DAYS)
+    curves = [{'courbe': curve, 'aliment': feed, 'conso_lait': milk, 'visites': counts}
+              for curve, feed, milk, counts in zip(courbe, aliment, conso_lait, visites)]
+    return {'curves': curves, 'start_date': '2000-01-01', 'end_date': '3000-01-01', 'ipg': IPG, 'weeks': weeks,
+            **options}
+
+def partial_export(source, path, drinks, visits):
+    """
+    Write the export of an earlier day: the consumptions and the visits up to some ids.
+    Args:
+    - source: Path of the whole export.
+    - path: Path of the partial export.
+    - drinks, visits: Highest consumption and visit ids kept.
+    Returns:
+    - None
+    """
+    limits = {'drinks': drinks, 'visits': visits}
+    with zipfile.ZipFile(source) as zipf, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as partial:
+        for member, schema in SCHEMAS.items():
+            lines = zipf.read(schema['filename']).decode('utf-8').splitlines(keepends=True)
+            if member in limits:
+                # The ids are the first column and increase through the file
+                lines = lines[:1] + [line for line in lines[1:] if int(line.split(';', 1)[0]) <= limits[member]]
+            partial.writestr(schema['filename'], ''.join(lines))
+
+def read_bytes(paths):
+    """Read the content of the output files, by file name."""
+    contents = {}
+    for path in paths:
+        with open(path, 'rb') as file:
+            contents[os.path.basename(path)] = file.read()
+    return contents
+
+class OutputsTest(unittest.TestCase):
+    """
+    The CSV outputs must not depend on the way they are computed: same bytes with
+    both engines, when the export is streamed, when the members come from the cache and
+    when the export is processed incrementally.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.TemporaryDirectory()
+        cls.exports = {}
+        for layout in LAYOUTS:
+            path = os.path.join(cls.folder.name, f'synthetic_{layout}.zip')
+            synthetic_export(path, cows=COWS, days=DAYS, layout=layout, curves=CURVES)
+            cls.exports[layout] = path
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.folder.cleanup()
+
+    def output_folder(self):
+        """Get a new folder for the outputs of one run."""
+        return tempfile.mkdtemp(dir=self.folder.name)
+
+    def pipeline_outputs(self, layout, engine='pandas', reader='arrow', cache=False):
+        """
+        Write all the outputs of a synthetic export with Pipeline.
+        Args:
+        - layout: Layout of the export, 'combined' or 'split'.
+        - engine: Engine of the joins and aggregations.
+        - reader: CSV parser of the members.
+        - cache: ExportCache of the parsed members, False for none.
+        Returns:
+        - Dictionary of the file contents by file name.
+        """
+        courbe, aliment, conso_lait, visites, weeks = curve_settings(DAYS)
+        pipeline = Pipeline(DalExport(self.exports[layout], engine=reader, cache=cache), courbe, aliment,
+                            conso_lait, visites, ipg=IPG, weeks=weeks, engine=engine)
+        frames = pipeline.run(list(OUTPUTS))
+        folder = self.output_folder()
+        files = [(frames[name], os.path.join(folder, OUTPUTS[name][1])) for name in OUTPUTS]
+        with contextlib.redirect_stdout(io.StringIO()):
+            paths = save_dataframes(files)
+        self.assertNotIn(None, paths)
+        return read_bytes(paths)
+
+    def test_engines(self):
+        for layout in LAYOUTS:
+            with self.subTest(layout=layout):
+                reference = self.pipeline_outputs(layout, 'pandas')
+                self.assertEqual(reference, self.pipeline_outputs(layout, 'arrow'))
+
+    def test_readers(self):
+        for layout in LAYOUTS:
+            with self.subTest(layout=layout):
+                reference = self.pipeline_outputs(layout, reader='pandas')
+                self.assertEqual(reference, self.pipeline_outputs(layout, reader='arrow'))
+
+    @unittest.skipUnless(ExportCache.available(), "the cache needs pyarrow")
+    def test_cache(self):
+        for layout in LAYOUTS:
+            with self.subTest(layout=layout):
+                cache = ExportCache(self.output_folder())
+                reference = self.pipeline_outputs(layout)
+                # The first run parses the members and stores them, the second one loads them
+                self.assertEqual(reference, self.pipeline_outputs(layout, cache=cache))
+                self.assertTrue(os.listdir(cache.directory))
+                loaded = []
+
+                def load(key, member, load=cache.load):
+                    data = load(key, member)
+                    if data is not None:
+                        loaded.append(member)
+                    return data
+
+                cache.load = load
+                self.assertEqual(reference, self.pipeline_outputs(layout, cache=cache))
+                self.assertEqual(sorted(loaded), ['animals', 'drinks', 'visits'])
+
+    def stream_outputs(self, layout, folder, **options):
+        """Stream all the outputs of a synthetic export in a folder, returning the written paths."""
+        courbe, aliment, conso_lait, visites, weeks = curve_settings(DAYS)
+        files = {name: os.path.join(folder, OUTPUTS[name][1]) for name in OUTPUTS}
+        with contextlib.redirect_stdout(io.StringIO()):
+            return stream_export(DalExport(self.exports[layout], engine='pandas', cache=False), files, courbe, aliment,
+                                 conso_lait, visites, ipg=IPG, weeks=weeks, chunksize=CHUNKSIZE, **options)
+
+    def test_stream(self):
+        for layout in LAYOUTS:
+            with self.subTest(layout=layout):
+                paths = self.stream_outputs(layout, self.output_folder())
+                self.assertNotIn(None, paths)
+                self.assertEqual(self.pipeline_outputs(layout), read_bytes(paths))
+
+    def test_stream_cancel(self):
+        class Cancelled(Exception):
+            pass
+
+        def cancel(consumptions):
+            chunks.append(consumptions)
+            raise Cancelled()
+
+        # The interface cancels a streamed run between two blocks of consumptions
+        folder, steps, chunks = self.output_folder(), [], []
+        with self.assertRaises(Cancelled):
+            self.stream_outputs('combined', folder, on_step=steps.append, on_chunk=cancel)
+        self.assertEqual(steps, ['cows', 'passages'])
+        self.assertEqual(chunks, [CHUNKSIZE])
+        self.assertEqual(os.listdir(folder), [])
+
+        # Without cancel, the runs are merged in a 'write' step after the passages
+        steps = []
+        self.stream_outputs('combined', folder, on_step=steps.append)
+        self.assertEqual(steps, ['cows', 'passages', 'write', 'visits', 'daily', 'complete_weeks'])
+
+    def test_stream_locked(self):
+        folder = self.output_folder()
+        locked = os.path.join(folder, OUTPUTS['pao'][1])
+        replace = os.replace
+
+        # DB_PAO.csv is open in another program: the merged runs are kept in a sibling file
+        def locked_replace(source, destination):
+            if destination == locked:
+                raise PermissionError(13, "Permission denied", destination)
+            replace(source, destination)
+
+        with mock.patch('os.replace', locked_replace):
+            paths = self.stream_outputs('combined', folder)
+        self.assertNotIn(None, paths)
+        self.assertNotEqual(paths[0], locked)
+        self.assertEqual(os.path.dirname(paths[0]), folder)
+        with open(paths[0], 'rb') as file:
+            self.assertEqual(self.pipeline_outputs('combined')[OUTPUTS['pao'][1]], file.read())
+
+    def test_incremental(self):
+        for layout in LAYOUTS:
+            with self.subTest(layout=layout):
+                folder = self.output_folder()
+                first, second = [os.path.join(folder, name) for name in PARTIAL_EXPORTS]
+                # The first export stops at half the consumptions, with the visits of the next 20
+                # consumptions: these visits only get their consumption in the second export
+                with zipfile.ZipFile(self.exports[layout]) as zipf:
+                    lines = zipf.read(SCHEMAS['drinks']['filename']).decode('utf-8').splitlines()[1:]
+                half = len(lines) // 2
+                partial_export(self.exports[layout], first, half, int(lines[half + 20].split(';')[1]))
+                partial_export(self.exports[layout], second, len(lines), 10 ** 9)
+
+                config = batch_config(incremental=True, state_dir=os.path.join(folder, 'state'))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    process_export(first, config, os.path.join(folder, 'first'), list(OUTPUTS))
+                    paths = process_export(second, config, os.path.join(folder, 'second'), list(OUTPUTS))
+                self.assertEqual(self.pipeline_outputs(layout), read_bytes(paths))
+
+    def test_batch_corrupt(self):
+        folder = self.output_folder()
+        corrupt = os.path.join(folder, 'corrupt.zip')
+        with open(self.exports['combined'], 'rb') as source, open(corrupt, 'wb') as file:
+            file.write(source.read()[:1000])
+        reference = self.pipeline_outputs('combined')
+
+        # The corrupt export fails alone, the other station and the herd-wide files are written
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                output = os.path.join(folder, f'batch_{jobs}')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    errors = run_batch([corrupt, self.exports['combined']], batch_config(), output, list(OUTPUTS),
+                                       jobs=jobs, combined=True)
+                self.assertEqual(list(errors), [corrupt])
+                station = os.path.join(output, 'synthetic_combined')
+                self.assertEqual(reference, read_bytes([os.path.join(station, OUTPUTS[name][1]) for name in OUTPUTS]))
+                with open(os.path.join(output, OUTPUTS['pao'][1]), 'rb') as file:
+                    combined = file.read().splitlines(keepends=True)
+                lines = reference[OUTPUTS['pao'][1]].splitlines(keepends=True)
+                expected = [b'Station;' + lines[0]] + [b'synthetic_combined;' + line for line in lines[1:]]
+                self.assertEqual(expected, combined)
+
+        # The command line reports the corrupt export and fails
+        config = os.path.join(folder, 'config.json')
+        with open(config, 'w', encoding='utf-8') as file:
+            json.dump(batch_config(), file)
+        with contextlib.redirect_stderr(io.StringIO()) as error:
+            self.assertEqual(main([corrupt, '-c', config, '-o', os.path.join(folder, 'cli')]), 1)
+        self.assertIn(corrupt, error.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
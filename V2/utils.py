@@ -1,86 +1,633 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from datetime import datetime
+import os
+import re
+import threading
+import numpy as np
 import pandas as pd
 import zipfile
+from Cache import ExportCache
+from Engine import open_engine
 
-def calculate_time_diff(row):
+# Optional multi-threaded CSV parser, the pandas parser is used when it is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pa_compute
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa_csv = None
+
+# Known layouts of the members of a DAL export. Each layout gives the raw columns
+# to read with their internal name, their type and the format of the date columns.
+# The exports either split the dates and times in '_datum'/'_zeit' columns or
+# combine them in one timestamp column.
+SCHEMAS = {
+    'animals': {
+        'filename': 'Export_instutut_export_nr_00.csv',
+        'layouts': {
+            'default': {
+                'columns': {'tiere_id': 'URBAN_ID', 'tier_nr': 'NUM', 'geburtsdatum': 'Date_Naiss', 'kurvennr': 'Courbe'},
+                'dtypes': {'tiere_id': 'int64', 'tier_nr': 'float64', 'geburtsdatum': 'str', 'kurvennr': 'int64'},
+                'dates': {'Date_Naiss': '%d/%m/%Y'}
+            }
+        }
+    },
+    'visits': {
+        'filename': 'Export_instutut_export_nr_01.csv',
+        'layouts': {
+            'split': {
+                'columns': {'stationsbesuch_id': 'ID_visite', 'tiere_id': 'URBAN_ID', 'erste_erkennung_datum': 'DATE', 'erste_erkennung_zeit': 'HEURE'},
+                'dtypes': {'stationsbesuch_id': 'int64', 'tiere_id': 'int64', 'erste_erkennung_datum': 'str', 'erste_erkennung_zeit': 'str'},
+                'dates': {'DATE': '%d/%m/%Y'}
+            },
+            'combined': {
+                'columns': {'stationsbesuch_id': 'ID_visite', 'tiere_id': 'URBAN_ID', 'erste_erkennung': 'debut'},
+                'dtypes': {'stationsbesuch_id': 'int64', 'tiere_id': 'int64', 'erste_erkennung': 'str'},
+                'dates': {'debut': 'ISO8601'}
+            }
+        }
+    },
+    'drinks': {
+        'filename': 'Export_instutut_export_nr_03.csv',
+        'layouts': {
+            'split': {
+                'columns': {
+                    'verbrauch_milch_id': 'ID_conso',
+                    'stationsbesuch_id': 'ID_visite',
+                    'tiere_id': 'URBAN_ID',
+                    'sollmenge_milch': 'Prog_lait',
+                    'verbrauch_milch': 'Conso_lait',
+                    'verbrauch_mat1': 'Conso_mat1',
+                    'verbrauch_mat2': 'Conso_mat2',
+                    'verbrauch_wasser': 'Conso_eau',
+                    'zeit_fuetterung_start_datum': 'Date_debut',
+                    'zeit_fuetterung_start_zeit': 'Heure_debut',
+                    'zeit_fuetterung_fertig_datum': 'Date_fin',
+                    'zeit_fuetterung_fertig_zeit': 'Heure_fin'
+                },
+                'dtypes': {
+                    'verbrauch_milch_id': 'int64', 'stationsbesuch_id': 'int64', 'tiere_id': 'int64',
+                    'sollmenge_milch': 'float64', 'verbrauch_milch': 'float64', 'verbrauch_mat1': 'float64', 'verbrauch_mat2': 'float64', 'verbrauch_wasser': 'float64',
+                    'zeit_fuetterung_start_datum': 'str', 'zeit_fuetterung_start_zeit': 'str',
+                    'zeit_fuetterung_fertig_datum': 'str', 'zeit_fuetterung_fertig_zeit': 'str'
+                },
+                'dates': {'Date_debut': '%d/%m/%Y', 'Date_fin': '%d/%m/%Y'}
+            },
+            'combined': {
+                'columns': {
+                    'verbrauch_milch_id': 'ID_conso',
+                    'stationsbesuch_id': 'ID_visite',
+                    'tiere_id': 'URBAN_ID',
+                    'sollmenge_milch': 'Prog_lait',
+                    'verbrauch_milch': 'Conso_lait',
+                    'verbrauch_mat1': 'Conso_mat1',
+                    'verbrauch_mat2': 'Conso_mat2',
+                    'verbrauch_wasser': 'Conso_eau',
+                    'zeit_fuetterung_start': 'debut',
+                    'zeit_fuetterung_fertig': 'fin'
+                },
+                'dtypes': {
+                    'verbrauch_milch_id': 'int64', 'stationsbesuch_id': 'int64', 'tiere_id': 'int64',
+                    'sollmenge_milch': 'float64', 'verbrauch_milch': 'float64', 'verbrauch_mat1': 'float64', 'verbrauch_mat2': 'float64', 'verbrauch_wasser': 'float64',
+                    'zeit_fuetterung_start': 'str', 'zeit_fuetterung_fertig': 'str'
+                },
+                'dates': {'debut': 'ISO8601', 'fin': 'ISO8601'}
+            }
+        }
+    }
+}
+
+# Members worth parsing with the multi-threaded engine (the animal list is small)
+ARROW_MEMBERS = ('visits', 'drinks')
+
+def station_name(zip_filename):
     """
-    Calculate the amount of time the cows drank.
+    Get the name of the station of an export from its file name.
     Args:
-    - row: Row in the dataset
+    - zip_filename: Path to the zip file (e.g. 2024_06_03__10_12_02_touch01__csv_export.zip).
     Returns:
-    - Time in 00:00:00 format
+    - Name of the station (e.g. touch01), or the file name without extension if it has no station.
     """
-    # Get the date and time data from the row
-    DStart = row["Date_debut"]
-    HStart = row["Heure_debut"]
-    DEnd = row["Date_fin"]
-    HEnd = row["Heure_fin"]
+    name = os.path.splitext(os.path.basename(zip_filename))[0]
+    match = re.search(r'_(touch\d+)__', name)
+    return match.group(1) if match else name
 
-    # Combine the date and time into a single datetime object
-    start_datetime = datetime.strptime(DStart + " " + HStart, "%Y-%m-%d %H:%M:%S")
-    end_datetime = datetime.strptime(DEnd + " " + HEnd, "%Y-%m-%d %H:%M:%S")
-    
-    # Calculate the difference between start and end times
-    time_difference = end_datetime - start_datetime
-    
-    # Format the time difference into hours, minutes, and seconds
-    hours, remainder = divmod(time_difference.total_seconds(), 3600)
-    minutes, seconds = divmod(remainder, 60)
-    
-    # Return the formatted time difference as a string
-    return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+def detect_layout(member, header):
+    """
+    Find the layout of a member from the columns of its header.
+    Args:
+    - member: Short name of the member ('animals', 'visits' or 'drinks').
+    - header: List of the column names of the CSV file.
+    Returns:
+    - Name of the layout in SCHEMAS.
+    """
+    for name, layout in SCHEMAS[member]['layouts'].items():
+        if set(layout['columns']).issubset(header):
+            return name
+    raise ValueError(f"Unknown layout for {SCHEMAS[member]['filename']}: {';'.join(header)}")
 
-def generate_bande(date_str):
+def read_member(zipf, member, engine='arrow', animals=None, after=None):
     """
-    Generate the value for "bande" columns by period of time during the years.
+    Read a member of the export with the columns, types and date formats of its layout.
     Args:
-    - date_str: Date from the data file of cow's birth to know the "bande".
+    - zipf: The opened zipfile.ZipFile of the export.
+    - member: Short name of the member ('animals', 'visits' or 'drinks').
+    - engine: 'arrow' to parse the large members with Arrow when pyarrow is installed, or 'pandas'.
+    - animals: URBAN_IDs to keep, the rows of the other animals are dropped while reading. None keeps every row.
+    - after: Dictionary of the highest ids already processed by id column (e.g. {'ID_conso': 1200}),
+      the rows with lower or equal ids are dropped while reading. None keeps every row.
     Returns:
-    - B2_XXXX or B1_XXXX
+    - DataFrame with the internal column names, dates parsed as datetime.
     """
-    # Convert the date string to a datetime object
-    date = pd.to_datetime(date_str)
-    
-    # Determine the "bande" based on the month of the date
-    if date.month < 7:
-        return f'B1_{date.year}'
+    if animals is not None or after:
+        return read_csv_filtered(zipf, member, engine, animals, after=after)
+
+    # The whole member is read as one block
+    return next(iter_member(zipf, member, engine, chunksize=None))
+
+def member_layout(zipf, member):
+    """
+    Detect the layout of a member from its header line only.
+    Args:
+    - zipf: The opened zipfile.ZipFile of the export.
+    - member: Short name of the member ('animals', 'visits' or 'drinks').
+    Returns:
+    - Layout of the member in SCHEMAS.
+    """
+    with zipf.open(SCHEMAS[member]['filename']) as file:
+        header = file.readline().decode('utf-8-sig').strip().split(';')
+    return SCHEMAS[member]['layouts'][detect_layout(member, header)]
+
+def typed_member(data, layout):
+    """
+    Rename the raw columns of a member and parse its dates.
+    Args:
+    - data: DataFrame with the raw column names of the layout.
+    - layout: Layout of the member in SCHEMAS.
+    Returns:
+    - DataFrame with the internal column names, dates parsed as datetime.
+    """
+    # Rename the columns and keep the order of the schema
+    data = data.rename(columns=layout['columns'])[list(layout['columns'].values())]
+
+    # Parse the dates with their known format
+    for column, date_format in layout['dates'].items():
+        data[column] = parse_dates(data[column], date_format)
+
+    return data
+
+def iter_member(zipf, member, engine='arrow', animals=None, chunksize=100000, after=None):
+    """
+    Read a member of the export block by block, for members too large to be held in memory.
+    Args:
+    - zipf: The opened zipfile.ZipFile of the export.
+    - member: Short name of the member ('animals', 'visits' or 'drinks').
+    - engine: 'arrow' or 'pandas' (see read_member).
+    - animals: URBAN_IDs to keep, None keeps every row.
+    - chunksize: Number of rows of each block (before the rows of other animals are dropped),
+      None to read the member as one block.
+    - after: Highest ids already processed by id column, see read_member.
+    Returns:
+    - Iterator of DataFrames as returned by read_member, in the order of the file.
+    """
+    layout = member_layout(zipf, member)
+    animals = None if animals is None else np.unique(np.asarray(animals, dtype='int64'))
+
+    # The ids are compared on the raw columns of the layout
+    raw_columns = {name: column for column, name in layout['columns'].items()}
+    after = {raw_columns[name]: mark for name, mark in (after or {}).items()}
+
+    with zipf.open(SCHEMAS[member]['filename']) as file:
+        reader = open_member_csv(file, layout, use_arrow(member, engine), chunksize)
+
+        # The blocks of the reader are gathered up to chunksize rows, an empty member gives one empty block
+        blocks, rows, empty = [], 0, True
+        for block in reader:
+            rows += len(block)
+            blocks.append(keep_rows(block, animals, after))
+            if chunksize is not None and rows >= chunksize:
+                yield typed_member(raw_frame(blocks, reader, layout), layout)
+                blocks, rows, empty = [], 0, False
+        if blocks or empty:
+            yield typed_member(raw_frame(blocks, reader, layout), layout)
+
+def use_arrow(member, engine):
+    """
+    Choose the CSV parser of a member.
+    Args:
+    - member: Short name of the member.
+    - engine: 'arrow' or 'pandas'.
+    Returns:
+    - True if the member is parsed with Arrow.
+    """
+    # Fall back to the pandas parser when pyarrow is not installed
+    return engine == 'arrow' and pa_csv is not None and member in ARROW_MEMBERS
+
+def open_member_csv(file, layout, arrow=True, chunksize=100000):
+    """
+    Open a CSV member to parse it block by block, with only the columns and types of its layout.
+    Args:
+    - file: File object of the member opened in the zip file.
+    - layout: Layout of the member in SCHEMAS.
+    - arrow: True for the multi-threaded Arrow streaming reader, False for the pandas reader.
+    - chunksize: Number of rows of each block of the pandas reader (None for one block),
+      the Arrow reader gives blocks of its own size.
+    Returns:
+    - Iterator of Arrow record batches or of DataFrames, with the raw column names of the layout.
+    """
+    if not arrow:
+        return pd.read_csv(file, delimiter=';', usecols=list(layout['columns']), dtype=layout['dtypes'],
+                           chunksize=chunksize, iterator=True)
+
+    arrow_types = {'int64': pa.int64(), 'float64': pa.float64(), 'str': pa.string()}
+    return pa_csv.open_csv(
+        file,
+        read_options=pa_csv.ReadOptions(use_threads=True),
+        parse_options=pa_csv.ParseOptions(delimiter=';'),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=list(layout['columns']),
+            column_types={column: arrow_types[dtype] for column, dtype in layout['dtypes'].items()}
+        )
+    )
+
+def keep_rows(block, animals=None, after=None):
+    """
+    Drop the rows of the other animals, and the rows already processed, from a block of open_member_csv.
+    Args:
+    - block: Arrow record batch or DataFrame with the raw column names.
+    - animals: Sorted array of the URBAN_IDs to keep, None keeps every animal.
+    - after: Dictionary of the highest ids already processed by raw id column, None keeps every id.
+    Returns:
+    - The block with the kept rows only.
+    """
+    after = after or {}
+    if animals is None and not after:
+        return block
+
+    if isinstance(block, pd.DataFrame):
+        kept = np.ones(len(block), dtype=bool)
+        if animals is not None:
+            kept &= block['tiere_id'].isin(animals).to_numpy()
+        for column, mark in after.items():
+            kept &= (block[column] > mark).to_numpy()
+        return block[kept]
+
+    masks = [] if animals is None else [pa_compute.is_in(block.column('tiere_id'), value_set=pa.array(animals))]
+    masks += [pa_compute.greater(block.column(column), mark) for column, mark in after.items()]
+    kept = masks[0]
+    for mask in masks[1:]:
+        kept = pa_compute.and_(kept, mask)
+    return block.filter(kept)
+
+def raw_frame(blocks, reader, layout):
+    """
+    Gather blocks of open_member_csv in one DataFrame.
+    Args:
+    - blocks: List of Arrow record batches or of DataFrames, possibly empty.
+    - reader: The reader of the blocks.
+    - layout: Layout of the member in SCHEMAS.
+    Returns:
+    - DataFrame with the raw column names of the layout, Arrow-backed with the Arrow reader.
+    """
+    if pa_csv is not None and isinstance(reader, pa_csv.CSVStreamingReader):
+        return pa.Table.from_batches(blocks, schema=reader.schema).to_pandas(types_mapper=pd.ArrowDtype)
+    if not blocks:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in layout['dtypes'].items()})
+    return blocks[0].reset_index(drop=True) if len(blocks) == 1 else pd.concat(blocks, ignore_index=True)
+
+def read_csv_filtered(zipf, member, engine, animals, chunksize=100000, after=None):
+    """
+    Parse a member block by block, keeping only the rows of some animals (and above some ids),
+    so that the whole member is never held in memory.
+    Args:
+    - zipf: The opened zipfile.ZipFile of the export.
+    - member: Short name of the member ('animals', 'visits' or 'drinks').
+    - engine: 'arrow' or 'pandas' (see read_member).
+    - animals: URBAN_IDs to keep, None for every animal.
+    - chunksize: Number of rows of each block.
+    - after: Highest ids already processed by id column, see read_member.
+    Returns:
+    - DataFrame as returned by read_member.
+    """
+    return pd.concat(iter_member(zipf, member, engine, animals, chunksize, after), ignore_index=True)
+
+class DalExport:
+    """
+    Session over one DAL ZIP export.
+    The archive is opened once and each CSV member is parsed at most once,
+    the parsed DataFrames are then shared by every function reading the export.
+    Args:
+    - zip_filename: The path to the zip file.
+    - engine: CSV parser of the members, 'arrow' or 'pandas' (see read_member).
+    - cache: ExportCache keeping the parsed members between runs, None for the default
+      cache (only when DAL_CACHE_DIR is set, see ExportCache.default) or False to disable it.
+      The cache needs pyarrow.
+    """
+    def __init__(self, zip_filename, engine='arrow', cache=None):
+        self.zip_filename = zip_filename
+        self.engine = engine
+        # Size and modification time identify the file on disk
+        stat = os.stat(zip_filename)
+        self.signature = (stat.st_size, stat.st_mtime)
+        self._zipf = zipfile.ZipFile(zip_filename, 'r')
+        self._frames = {}
+        self._births = None
+        # The members can be read from a background thread (e.g. the curves prefetched by the interface)
+        self._lock = threading.RLock()
+
+        # The parsed members are cached under the fingerprint of the ZIP content
+        if cache is None:
+            cache = ExportCache.default()
+        self.cache = cache if cache and cache.available() else None
+        self.fingerprint = ExportCache.fingerprint(self._zipf, engine) if self.cache else None
+
+    def read(self, member, animals=None, after=None):
+        """
+        Return the typed DataFrame of a member, parsing it on first use.
+        Args:
+        - member: Short name of the member ('animals', 'visits' or 'drinks').
+        - animals: URBAN_IDs to keep, None for every animal.
+        - after: Highest ids already processed by id column (see read_member), for the
+          incremental mode. The new rows are read without the cache and are not kept.
+        Returns:
+        - DataFrame shared by all callers, it must not be modified in place.
+        """
+        with self._lock:
+            if after:
+                return read_member(self._zipf, member, self.engine, animals, after)
+            return self._read(member, animals)
+
+    def _read(self, member, animals=None):
+        if animals is not None:
+            # Without a cache, the whole member is not kept: the other animals are dropped while reading
+            if member not in self._frames and not self.cache:
+                key = (member, tuple(sorted(set(animals))))
+                if key not in self._frames:
+                    self._frames[key] = read_member(self._zipf, member, self.engine, animals)
+                return self._frames[key]
+            data = self._read(member)
+            return data[data['URBAN_ID'].isin(animals)].reset_index(drop=True)
+
+        if member not in self._frames:
+            data = self.cache.load(self.fingerprint, member) if self.cache else None
+            if data is None:
+                data = read_member(self._zipf, member, self.engine)
+                if self.cache:
+                    self.cache.store(self.fingerprint, member, data)
+            self._frames[member] = data
+        return self._frames[member]
+
+    def birth_index(self):
+        """
+        Return the birth days of the cows sorted once, to find the cows of a birth window
+        by bisection.
+        Returns:
+        - (births, curves, order): birth days and curves of the animals in file order, and
+          the positions of the animals sorted by birth (missing dates last).
+        """
+        with self._lock:
+            if self._births is None:
+                animals = self._read('animals')
+                births = animals['Date_Naiss'].dt.normalize().to_numpy()
+                self._births = (births, animals['Courbe'].to_numpy(), np.argsort(births, kind='stable'))
+            return self._births
+
+    def indexed(self):
+        """
+        Check if the birth index is built, so the curves of a window are found at once.
+        Returns:
+        - True once birth_index was called.
+        """
+        return self._births is not None
+
+    def curves(self, start_date, end_date):
+        """
+        Find the curves of the cows born in a window, without filtering the animal list.
+        Args:
+        - start_date: Date of the first birth, "YYYY-MM-DD".
+        - end_date: Date of the last birth, "YYYY-MM-DD" (included).
+        Returns:
+        - List of the curves, in the order of the first birth of each curve.
+        """
+        births, curves, order = self.birth_index()
+        start = np.datetime64(datetime.strptime(start_date, "%Y-%m-%d")).astype(births.dtype)
+        end = np.datetime64(datetime.strptime(end_date, "%Y-%m-%d")).astype(births.dtype)
+        sorted_births = births[order]
+        first, last = np.searchsorted(sorted_births, start, side='left'), np.searchsorted(sorted_births, end, side='right')
+
+        # Only the cows of the window are sorted again, as animal_caract does, so the curves keep its order
+        rows = np.sort(order[first:last])
+        rows = rows[pd.Series(births[rows]).sort_values().index]
+        return pd.unique(curves[rows]).tolist()
+
+    def iter_chunks(self, member, animals=None, chunksize=100000):
+        """
+        Read a member block by block, without keeping it (see iter_member).
+        Args:
+        - member: Short name of the member ('animals', 'visits' or 'drinks').
+        - animals: URBAN_IDs to keep, None for every animal.
+        - chunksize: Number of rows of each block.
+        Returns:
+        - Iterator of DataFrames.
+        """
+        return iter_member(self._zipf, member, self.engine, animals, chunksize)
+
+    def member_size(self, member):
+        """
+        Get the uncompressed size of a member.
+        Args:
+        - member: Short name of the member ('animals', 'visits' or 'drinks').
+        Returns:
+        - Size in bytes.
+        """
+        return self._zipf.getinfo(SCHEMAS[member]['filename']).file_size
+
+    def is_current(self, zip_filename):
+        """
+        Check if the session still describes the given file on disk.
+        Args:
+        - zip_filename: The path to the zip file.
+        Returns:
+        - True if the path is the same and the file was not modified.
+        """
+        try:
+            stat = os.stat(zip_filename)
+        except OSError:
+            return False
+        return zip_filename == self.zip_filename and (stat.st_size, stat.st_mtime) == self.signature
+
+    def close(self):
+        """Close the archive, the members already parsed stay available."""
+        self._zipf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+@contextlib.contextmanager
+def open_export(source):
+    """
+    Get a DalExport session from a zip path or an existing session, to use in a `with` block.
+    A session opened from a path is closed at the end of the block, an existing session is
+    left open for its owner.
+    Args:
+    - source: The path to the zip file or a DalExport.
+    Returns:
+    - Context manager giving the DalExport.
+    """
+    if isinstance(source, DalExport):
+        yield source
+        return
+    with DalExport(source) as export:
+        yield export
+
+def parse_date_strings(strings, date_format):
+    """
+    Parse date strings with their known format.
+    The DAL writes the midnight ending a day as '24:00:00', it is read as 00:00:00 of the next day.
+    Args:
+    - strings: Series of date strings.
+    - date_format: Format of the strings ('%d/%m/%Y', '%Y-%m-%d', 'ISO8601', ...).
+    Returns:
+    - Series of datetime64, NaT for missing values.
+    """
+    parsed = pd.to_datetime(strings, format=date_format, errors='coerce')
+
+    # Only the strings that could not be parsed are checked for '24:00:00', other errors are raised
+    failed = parsed.isna() & strings.notna()
+    if failed.any():
+        fixed = strings[failed].astype(str)
+        midnight = fixed.str.contains('24:00:00', regex=False)
+        retry = pd.to_datetime(fixed.str.replace('24:00:00', '00:00:00', regex=False), format=date_format)
+        parsed[failed] = retry + pd.to_timedelta(midnight.astype(int), unit='D')
+    return parsed
+
+def parse_dates(values, date_format=None):
+    """
+    Parse dates with their known format, each distinct value only once.
+    Args:
+    - values: Series of date strings, or of datetime.date.
+    - date_format: Format of the strings (see parse_date_strings), None for datetime.date values.
+    Returns:
+    - Series of datetime64 with the index of values, NaT for missing values.
+    """
+    # Timestamps with microseconds are nearly all different, caching them would only cost time
+    sample = values.iloc[:1000]
+    if date_format is not None and sample.nunique() * 2 > len(sample):
+        return parse_date_strings(values, date_format)
+
+    # The dates repeat a lot, only the distinct values are parsed
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques)
+    parsed = pd.to_datetime(uniques) if date_format is None else parse_date_strings(uniques, date_format)
+
+    # Map the parsed values back to the rows
+    return pd.Series(parsed.array.take(codes, allow_fill=True), index=values.index, name=values.name)
+
+def parse_times(values):
+    """
+    Parse times of the day in 00:00:00 format, each distinct value only once.
+    Args:
+    - values: Series of time strings, '24:00:00' is the end of the day.
+    Returns:
+    - Series of timedelta since midnight with the index of values, NaT for missing values.
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques).astype(str)
+
+    # Read the digits directly when every time has the 00:00:00 format, pandas is much slower
+    digits = None
+    if len(uniques) and (uniques.str.len() == 8).all() and (uniques.str[2] == ':').all() and (uniques.str[5] == ':').all():
+        digits = uniques.to_numpy(dtype='S8').view(np.uint8).reshape(-1, 8)[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - 48
+    if digits is not None and ((digits >= 0) & (digits <= 9)).all():
+        seconds = (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 2] * 10 + digits[:, 3]) * 60 + digits[:, 4] * 10 + digits[:, 5]
+        parsed = pd.Series(pd.to_timedelta(seconds, unit='s'))
     else:
-        return f'B2_{date.year}'
+        parsed = pd.to_timedelta(uniques)
+    return pd.Series(parsed.array.take(codes, allow_fill=True), index=values.index, name=values.name)
+
+def format_duration(durations):
+    """
+    Format durations for the output files.
+    Args:
+    - durations: Series of timedelta.
+    Returns:
+    - Series of times in 00:00:00 format
+    """
+    # Get the durations in whole seconds
+    seconds = durations.dt.total_seconds().astype(int)
+
+    # Format the durations into hours, minutes, and seconds
+    hours = (seconds // 3600).astype(str).str.zfill(2)
+    minutes = (seconds % 3600 // 60).astype(str).str.zfill(2)
+    seconds = (seconds % 60).astype(str).str.zfill(2)
+
+    return hours + ":" + minutes + ":" + seconds
+
+def format_dates(values, date_format):
+    """
+    Format dates for the output files, each distinct date is formatted once.
+    Args:
+    - values: Series of datetime.
+    - date_format: strftime format of the labels.
+    Returns:
+    - Series of strings, NaN for missing dates
+    """
+    codes, uniques = pd.factorize(values)
+    labels = pd.Series(uniques).dt.strftime(date_format).to_numpy(dtype=object)
+    return pd.Series(pd.array(labels, dtype=object).take(codes, allow_fill=True), index=values.index, name=values.name)
+
+def format_times(values):
+    """
+    Format the times of day of datetimes for the output files.
+    Args:
+    - values: Series of datetime.
+    Returns:
+    - Series of times in 00:00:00 format, NaN for missing times
+    """
+    # A day has at most 86400 seconds, only these are formatted
+    codes, uniques = pd.factorize(values - values.dt.normalize())
+    labels = format_duration(pd.Series(uniques)).to_numpy(dtype=object)
+    return pd.Series(pd.array(labels, dtype=object).take(codes, allow_fill=True), index=values.index, name=values.name)
+
+def generate_bande(dates):
+    """
+    Generate the values for "bande" columns by period of time during the years.
+    Args:
+    - dates: Series of dates of cow's birth to know the "bande".
+    Returns:
+    - Series of B2_XXXX or B1_XXXX
+    """
+    # Convert the dates to datetime
+    dates = parse_dates(dates)
+
+    # Determine the "bande" based on the month of the date
+    half = pd.Series(np.where(dates.dt.month < 7, 'B1_', 'B2_'), index=dates.index)
+    return half + dates.dt.year.astype(str)
 
 def animal_caract(zip_filename, start_date, end_date):
     """
     Unzip raw data from the DAL to use file 00 and clean it.
     Args:
-    - zip_filename: The path to the zip file.
+    - zip_filename: The path to the zip file or a DalExport.
     - start_date: Date of the first birth of cow's session.
     - end_date: Date of the last birth of cow's session.
     Returns:
     - Data files with ID of cows (urban, UEPAO, date of birth, lot, bande)
     """
-    # Dictionary to rename columns
-    rename_dict = {
-        'tiere_id': 'URBAN_ID',
-        'tier_nr': 'NUM',
-        'geburtsdatum': 'Date_Naiss',
-        'kurvennr': 'Courbe'
-    }
+    # Get the typed data of the DAL from the export session (shared, it is not modified)
+    with open_export(zip_filename) as export:
+        cows_id = export.read('animals')
 
-    # Unzip the raw data from the DAL
-    with zipfile.ZipFile(zip_filename, 'r') as zipf:
-        with zipf.open('Export_instutut_export_nr_00.csv') as file:
-            cows_id = pd.read_csv(file, delimiter=';')
-                    
-    # Rename columns according to the dictionary
-    cows_id.rename(columns=rename_dict, inplace=True)
-    # Keep only the renamed columns
-    cows_id = cows_id[list(rename_dict.values())]
-
-    # Convert start and end date strings to datetime.date
-    start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-    end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+    # Convert start and end date strings to datetime
+    start_date = datetime.strptime(start_date, "%Y-%m-%d")
+    end_date = datetime.strptime(end_date, "%Y-%m-%d")
     
-    # Convert 'Date_Naiss' column to datetime.date
-    cows_id['Date_Naiss'] = pd.to_datetime(cows_id['Date_Naiss'], dayfirst=True).dt.date
+    # Keep the day of 'Date_Naiss', it stays a datetime until it is written
+    cows_id = cows_id.assign(Date_Naiss=cows_id['Date_Naiss'].dt.normalize())
 
     # Filter rows based on start and end dates
     cows_id = cows_id[(cows_id['Date_Naiss'] >= start_date) & (cows_id['Date_Naiss'] <= end_date)]
@@ -89,113 +636,82 @@ def animal_caract(zip_filename, start_date, end_date):
     cows_id = cows_id.sort_values(by='Date_Naiss', ascending=True)
 
     # Insert 'Bande' column based on 'Date_Naiss'
-    cows_id.insert(3, 'Bande', cows_id['Date_Naiss'].apply(generate_bande))
+    cows_id.insert(3, 'Bande', generate_bande(cows_id['Date_Naiss']))
     
     return cows_id
 
-def animal_data(zip_filename):
+def animal_data(zip_filename, animals=None, after=None):
     """
     Unzip raw data from the DAL to use file 03 and clean it.
     Args:
-    - zip_filename: The path to the zip file.
+    - zip_filename: The path to the zip file or a DalExport.
+    - animals: URBAN_IDs of the cows to keep (e.g. the cows of the session), None for every cow.
+    - after: Highest consumption id already processed ({'ID_conso': id}), None for every drink.
     Returns:
-    - Data files with drink measurements of cows
+    - Data files with drink measurements of cows, with the 'debut' and 'fin' datetimes of each drink
     """
-    # Dictionary to rename columns
+    # Get the typed data of the DAL from the export session (shared, it is not modified)
+    with open_export(zip_filename) as export:
+        return drink_times(export.read('drinks', animals, after))
 
-    # Unzip the raw data from the DAL
-    with zipfile.ZipFile(zip_filename, 'r') as zipf:
-        with zipf.open('Export_instutut_export_nr_03.csv') as file:
-            cows_data = pd.read_csv(file, delimiter=';')
-            
-    try:
-        rename_dict = {
-        'tiere_id': 'URBAN_ID',
-        'sollmenge_milch': 'Prog_lait',
-        'verbrauch_milch': 'Conso_lait',
-        'verbrauch_mat1': 'Conso_mat1',
-        'verbrauch_mat2': 'Conso_mat2',
-        'verbrauch_wasser': 'Conso_eau',
-        'zeit_fuetterung_start_datum': 'Date_debut',
-        'zeit_fuetterung_start_zeit': 'Heure_debut',
-        'zeit_fuetterung_fertig_datum': 'Date_fin',
-        'zeit_fuetterung_fertig_zeit': 'Heure_fin'
-        }
-        # Rename columns according to the dictionary and keep them
-        cows_data.rename(columns=rename_dict, inplace=True)
-        cows_data = cows_data[list(rename_dict.values())]
-    except :
-        rename_dict = {
-        'tiere_id': 'URBAN_ID',
-        'sollmenge_milch': 'Prog_lait',
-        'verbrauch_milch': 'Conso_lait',
-        'verbrauch_mat1': 'Conso_mat1',
-        'verbrauch_mat2': 'Conso_mat2',
-        'verbrauch_wasser': 'Conso_eau',
-        'zeit_fuetterung_start': 'debut',
-        'zeit_fuetterung_fertig': 'fin',
-        }
-        # Rename columns according to the dictionary and keep them
-        cows_data.rename(columns=rename_dict, inplace=True)
-        cows_data = cows_data[list(rename_dict.values())]
-        
-        cows_data['debut'] = pd.to_datetime(cows_data['debut'])
-        cows_data['fin'] = pd.to_datetime(cows_data['fin'])
-        cows_data['Date_debut'] = cows_data['debut'].dt.date.astype(str)
-        cows_data['Date_fin'] = cows_data['fin'].dt.date.astype(str)
-        cows_data['Heure_debut'] = cows_data['debut'].dt.strftime('%H:%M:%S')
-        cows_data['Heure_fin'] = cows_data['fin'].dt.strftime('%H:%M:%S')
-        
-        cows_data.drop(columns=['debut', 'fin'], inplace=True)
-        
-    return cows_data
-
-def data_global(zip_filename, start: str):
+def iter_animal_data(zip_filename, animals=None, chunksize=100000):
+    """
+    Read and clean file 03 block by block, see animal_data.
+    Args:
+    - zip_filename: The path to the zip file or a DalExport.
+    - animals: URBAN_IDs of the cows to keep, None for every cow.
+    - chunksize: Number of rows of each block.
+    Returns:
+    - Iterator of DataFrames of drink measurements, in the order of the file.
+    """
+    with open_export(zip_filename) as export:
+        for cows_data in export.iter_chunks('drinks', animals, chunksize):
+            yield drink_times(cows_data)
+
+def drink_times(cows_data):
+    """
+    Give each drink one start ('debut') and one end ('fin') datetime, whatever the layout of file 03.
+    Args:
+    - cows_data: Typed DataFrame of file 03.
+    Returns:
+    - DataFrame with 'debut' and 'fin' instead of the date and time columns.
+    """
+    if 'debut' in cows_data.columns:
+        # Keep the whole seconds, as written in the output files
+        return cows_data.assign(debut=cows_data['debut'].dt.floor('s'), fin=cows_data['fin'].dt.floor('s'))
+
+    # Combine the date and time columns into one start and one end
+    cows_data = cows_data.assign(
+        debut=cows_data['Date_debut'] + parse_times(cows_data['Heure_debut']),
+        fin=cows_data['Date_fin'] + parse_times(cows_data['Heure_fin'])
+    )
+    return cows_data.drop(columns=['Date_debut', 'Heure_debut', 'Date_fin', 'Heure_fin'])
+
+def data_global(zip_filename, start: str, animals=None, after=None):
     """
     Extract and process global data from a zip file.
     Args:
-    - zip_filename: Path to the zip file.
+    - zip_filename: Path to the zip file or a DalExport.
     - start: Start date as a string in the format "YYYY-MM-DD".
+    - animals: URBAN_IDs of the cows to keep, None for every cow.
+    - after: Highest visit id already processed ({'ID_visite': id}), None for every visit.
     Returns:
     - Filtered and sorted DataFrame.
     """
+    # Get the typed data of the DAL from the export session (shared, it is not modified)
+    with open_export(zip_filename) as export:
+        data = export.read('visits', animals, after)
+
+    if 'debut' in data.columns:
+        # Split the combined timestamps into date and time columns
+        data = data.assign(DATE=data['debut'], HEURE=format_times(data['debut']))
+        data = data.drop(columns=['debut'])
 
-    # Unzip and read the raw data from the DAL
-    with zipfile.ZipFile(zip_filename, 'r') as zipf:
-        with zipf.open('Export_instutut_export_nr_01.csv') as file:
-            data = pd.read_csv(file, delimiter=';')
-    try:
-        # Dictionary to rename columns
-        rename_dict = {
-            'tiere_id': 'URBAN_ID',
-            'erste_erkennung_datum': 'DATE',
-            'erste_erkennung_zeit': 'HEURE'
-        }
-        # Rename columns according to the dictionary
-        data.rename(columns=rename_dict, inplace=True)
-        # Keep only the renamed columns
-        data = data[list(rename_dict.values())]
-    except:
-        # Dictionary to rename columns
-        rename_dict = {
-            'tiere_id': 'URBAN_ID',
-            'erste_erkennung': 'debut'
-        }
-        # Rename columns according to the dictionary
-        data.rename(columns=rename_dict, inplace=True)
-        # Keep only the renamed columns
-        data = data[list(rename_dict.values())]
-        data['debut'] = pd.to_datetime(data['debut'])
-        data['DATE'] = data['debut'].dt.date.astype(str)
-        data['HEURE'] = data['debut'].dt.strftime('%H:%M:%S')
-        
-        data.drop(columns=['debut'], inplace=True)
-        
     # Convert start date string to datetime.date
     start_date = datetime.strptime(start, "%Y-%m-%d").date()
     
     # Convert 'DATE' column to datetime.date
-    data['DATE'] = pd.to_datetime(data['DATE'], dayfirst=True).dt.date
+    data = data.assign(DATE=data['DATE'].dt.date)
 
     # Filter rows based on start date
     filtered_data = data[(data['DATE'] >= start_date)]
@@ -206,79 +722,170 @@ def data_global(zip_filename, start: str):
     
     return filtered_data
 
+def visit_milk(drinks, engine=None):
+    """
+    Add up the consumptions of each station visit.
+    Args:
+    - drinks: DataFrame of file 03 with 'ID_visite' and 'Conso_lait', or visits already added up by this function.
+    - engine: Engine of the aggregation (see Engine.open_engine), pandas by default.
+    Returns:
+    - DataFrame with 'ID_visite', the milk consumed in 'Conso_lait' and the number of consumptions in 'Nb_conso'.
+    """
+    if 'Nb_conso' in drinks.columns:
+        return open_engine(engine).sum_by(drinks, ['ID_visite'], ['Conso_lait', 'Nb_conso'])
+    return open_engine(engine).sum_by(drinks, ['ID_visite'], ['Conso_lait'], count='Nb_conso')
+
+def visit_facts(zip_filename, start: str, animals=None, engine=None, milk=None, after=None):
+    """
+    Build the table of the station visits, each visit with the milk it gave.
+    The consumptions (nr_03) are joined to the visits (nr_01) on the visit id
+    (stationsbesuch_id), so a visit without consumption is a visit without right.
+    Args:
+    - zip_filename: Path to the zip file or a DalExport.
+    - start: Start date as a string in the format "YYYY-MM-DD".
+    - animals: URBAN_IDs of the cows to keep, None for every cow.
+    - engine: Engine of the join and aggregation (see Engine.open_engine), pandas by default.
+    - milk: Consumptions of each visit from visit_milk, read from file 03 when not given.
+    - after: Highest visit id already processed ({'ID_visite': id}), None for every visit.
+    Returns:
+    - DataFrame of data_global with 'Lait' (True if the visit gave milk), 'Nb_conso'
+      (number of consumptions) and 'Conso_lait' (milk consumed, 0 without right).
+    """
+    engine = open_engine(engine)
+    with open_export(zip_filename) as export:
+        visits = data_global(export, start, animals, after)
+
+        # A visit can give several consumptions, they are added up before the join
+        if milk is None:
+            milk = visit_milk(export.read('drinks', animals), engine)
+    facts = engine.join(visits, milk, 'ID_visite', how='left')
+
+    facts['Lait'] = facts['Nb_conso'].notna()
+    facts['Nb_conso'] = facts['Nb_conso'].fillna(0).astype('int64')
+    facts['Conso_lait'] = facts['Conso_lait'].fillna(0.0)
+    return facts
+
+def save_file(write, chemin):
+    """
+    Write a file through a temporary file renamed at the end, so that the file is never
+    left half written. If the file is locked (e.g. open in Excel), the temporary file is
+    renamed next to it with the current time in its name, so the result is not lost.
+    Args:
+    - write: Function writing the content of the file to the path it is given.
+    - chemin (str): The full file path of the file.
+    Returns:
+    - str: The path of the written file, None if nothing could be written.
+    """
+    temporary = f'{chemin}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        write(temporary)
+        try:
+            os.replace(temporary, chemin)
+            print(f"DataFrame saved successfully to {chemin}")
+            return chemin
+        except PermissionError:
+            print(f"Permission denied: You do not have permission to write to {chemin} (file might be open).")
+
+        # Keep the result in a sibling file rather than losing it
+        root, extension = os.path.splitext(chemin)
+        sibling = f"{root}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}"
+        os.replace(temporary, sibling)
+        print(f"DataFrame saved to {sibling} instead")
+        return sibling
+    except Exception as e:
+        print(f"Error saving file: {str(e)}")
+        return None
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def format_durations(df):
+    """
+    Format the duration columns of a DataFrame in 00:00:00 format, as they are written.
+    Args:
+    - df (pandas.DataFrame): The DataFrame to write.
+    Returns:
+    - pandas.DataFrame: The same DataFrame if it has no duration column, a formatted copy otherwise.
+    """
+    durations = df.select_dtypes(include='timedelta').columns
+    if len(durations):
+        df = df.assign(**{column: format_duration(df[column]) for column in durations})
+    return df
+
 def save_dataframe(df, chemin):
     """
     Save the DataFrame to a CSV file at the specified location.
+    Duration columns are written in 00:00:00 format. If the file is locked (e.g. open
+    in Excel), the data is saved next to it in a file named with the current time.
     Args:
     - df (pandas.DataFrame): The DataFrame to save.
     - chemin (str): The full file path where the CSV should be saved, including the file name.
     Returns:
-    - None
+    - str: The path of the written file, None if nothing could be written.
     """
-    try:
-        df.to_csv(chemin, index=False, sep=';')  # Use semicolon as separator
-        print(f"DataFrame saved successfully to {chemin}")
-    except PermissionError:
-        print(f"Permission denied: You do not have permission to write to {chemin} (file might be open).")
-    except Exception as e:
-        print(f"Error saving file: {str(e)}")
+    # Format the durations, they stay numeric until they are written
+    df = format_durations(df)
+    return save_file(lambda path: df.to_csv(path, index=False, sep=';'), chemin)  # Use semicolon as separator
+
+def save_dataframes(files, max_workers=None):
+    """
+    Save several DataFrames to CSV files in parallel, see save_dataframe.
+    Args:
+    - files: List of (DataFrame, path) pairs.
+    - max_workers: Number of writing threads, one per file by default.
+    Returns:
+    - list: The paths of the written files, in the order of files (None for a failed file).
+    """
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers or len(files)) as executor:
+        return list(executor.map(lambda file: save_dataframe(*file), files))
 
-def data_cleaned_without_week(df, nb):
+def data_cleaned_without_week(df, nb, first_day=3):
     """
     Keep weeks composed of 7 days of data and remove cows not needed for the experiment.
     Args:
     - df: Data of the complete but uncleaned final DataFrame.
     - nb: Number of weeks threshold.
+    - first_day: First day of life expected in week s1 (the first days are usually not recorded).
     Returns:
     - Final data to export without weeks with less than 7 days for the average.
     """
     # Filter cows with less than the required number of values (e.g., for 9 weeks, there must be more than 37 entries)
     df = df[(df.groupby('NUM')['NUM'].transform('count')) >= int(nb) * 7 * 3 / 5]
 
-    # Initialize an empty DataFrame to store the complete data
-    df_complet = pd.DataFrame(columns=df.columns)
-
-    # Group by 'NUM'
-    grouped = df.groupby('NUM')
-
-    # Iterate through each group
-    for num, group in grouped:
-        # Check each unique week in the group
-        for semaine in group['Sem'].unique():
-            # Check the ages present in this week
-            ages_presents = group[group['Sem'] == semaine]['JOUR'].unique()
-
-            # Calculate the expected ages for a complete week
-            if semaine == "s1":
-                ages_attendus = range(3, int(semaine[1:]) * 7)
-            else:
-                ages_attendus = range((int(semaine[1:]) - 1) * 7, int(semaine[1:]) * 7)
-
-            # Check if all expected ages are present
-            if set(ages_attendus) == set(ages_presents):
-                df_complet = pd.concat([df_complet, group[group['Sem'] == semaine]], ignore_index=True)
-            else:
-                # Uncomment the print statement if you want to see which weeks are ignored
-                # print(f"Week {semaine} is not complete and will be ignored for NUM={num}.")
-                pass
-                
+    # Calculate the days expected in each week: s1 starts at first_day, the other weeks have 7 days
+    week = df['Week']
+    first = np.where(week == 1, first_day, (week - 1) * 7)
+    last = week * 7 - 1
+    expected = pd.Series(last - first + 1, index=df.index)
+    in_week = (df['JOUR'] >= first) & (df['JOUR'] <= last)
+
+    # A week is complete when all its days are the expected ones and none is missing
+    keys = [df['NUM'], df['Week']]
+    days_present = df['JOUR'].groupby(keys).transform('nunique')
+    all_in_week = in_week.groupby(keys).transform('all')
+    complete = all_in_week & (days_present == expected)
+
+    # Keep the complete weeks, cow by cow
+    df_complet = df[complete].sort_values(by='NUM', kind='stable')
+    df_complet.reset_index(drop=True, inplace=True)
+
     return df_complet
 
 def curve(zip_filename, start_date="2000-01-01", end_date="3000-01-01"):
     """
     Extract unique curve data from animal characteristics within a date range.
     Args:
-    - zip_filename: Path to the zip file.
+    - zip_filename: Path to the zip file or a DalExport.
     - start_date: Start date as a string in the format "YYYY-MM-DD".
     - end_date: End date as a string in the format "YYYY-MM-DD".
     Returns:
     - List of unique curves.
     """
-    data = animal_caract(zip_filename, start_date, end_date)
-    data = data['Courbe']
-    data = data.unique().tolist()
-    
-    return data
+    # The birth dates are sorted once per export session, a window is a bisection
+    with open_export(zip_filename) as export:
+        return export.curves(start_date, end_date)
 
 if __name__ == "__main__":
     